@@ -1,11 +1,17 @@
-
 import numpy as np
 from model.graph_env import State
-from utils.measures import get_proximity
+from utils.paths import PathBuffer, VisitStamps, get_path_edges, loop_erase, shortcut_path
+from utils.sampling import UniformStream, get_rng, roulette_wheel
+from model.kernels import NUMBA_AVAILABLE, construct_tour
 import logging
+import json
+import os
 
 class AntColonyOptimizer():
-  def __init__(self, graph, ants, alpha, beta, p, local_p = None, intensity = None, q_0 = None):
+  def __init__(self, graph, ants, alpha, beta, p, local_p = None, intensity = None, q_0 = None,
+               deposit = 'best_so_far', elite_weight = 6, postprocess = None,
+               mmas = False, tau_min = None, tau_max = None, p_best = 0.05, smoothing = None,
+               rng = None):
     """
     Ant colony optimizer.  Traverses a graph and finds the min weight distance
     :param graph: graph environment
@@ -16,7 +22,37 @@ class AntColonyOptimizer():
     :param local_p: local evaporation rate at which pheromone evaporates (optional)
     :param intensity: the amount of pheromones to add per edge (optional)
     :param q_0: probability to choose the best construction step (optional)
+    :param deposit: paths that receive pheromone in the global update (optional).
+                    'best_so_far', 'iteration_best', 'elitist' (every ant of the
+                    iteration plus the best so far) or 'rank' (the best ranked
+                    ants of the iteration plus the best so far)
+    :param elite_weight: weight of the best path so far for the 'elitist' and
+                         'rank' deposits, 'rank' also ranks elite_weight - 1 ants
+    :param postprocess: processing of the completed tours before they compete
+                        with the best path and receive pheromone (optional).
+                        'loop_erase' removes the cycles of the tour and
+                        'shortcut' also replaces the detours between
+                        neighbor nodes with a single edge
+    :param mmas: Max-Min Ant System bounds, the pheromones are clamped to
+                 [tau_min, tau_max] in the global update. The bounds that
+                 are not given follow the best path so far (optional)
+    :param tau_min: lower bound of the pheromones (optional)
+    :param tau_max: upper bound of the pheromones (optional)
+    :param p_best: probability of building the best path once the colony
+                   converges, it defines tau_min from tau_max in mmas mode
+    :param smoothing: pheromone trail smoothing factor in [0, 1], a restart
+                      moves each pheromone that fraction of the way towards
+                      tau_max instead of re-initializing it, it needs mmas
+                      or tau_max (optional)
+    :param rng: numpy.random.Generator or seed of the random decisions (optional)
     """
+    if deposit not in ('best_so_far', 'iteration_best', 'elitist', 'rank'):
+      raise ValueError("Unknown deposit: {}".format(deposit))
+    if postprocess not in (None, 'loop_erase', 'shortcut'):
+      raise ValueError("Unknown postprocess: {}".format(postprocess))
+    if smoothing is not None and not mmas and tau_max is None:
+      raise ValueError("The smoothing needs tau_max or the mmas bounds")
+
     self.graph = graph
     self.ants = ants
     self.alpha = alpha
@@ -25,67 +61,257 @@ class AntColonyOptimizer():
     self.local_p = local_p
     self.intensity = intensity
     self.q_0 = q_0
+    self.deposit = deposit
+    self.elite_weight = elite_weight
+    self.postprocess = postprocess
+    self.mmas = mmas
+    self.tau_min = tau_min
+    self.tau_max = tau_max
+    self.p_best = p_best
+    self.smoothing = smoothing
+    self.rng = get_rng(rng)
+    self.uniforms = UniformStream(self.rng)
 
-    self.best_path = []
+    self.path = PathBuffer(graph.number_of_nodes())
+    self.reset_best_path()
     self.reset_environment()
 
+  def reset_best_path(self):
+    """forget the best path so far and the paths of the iteration
+    """
+    # best path so far as a sequence of nodes and as its unique edges
+    self.best_path = np.empty(0, dtype=np.int64)
+    self.best_path_edges = np.empty(0, dtype=np.int64)
+    self.best_distance = float('inf')
+    # best path of the current iteration and (cost, unique edges) of the
+    # ants that got the target in this iteration
+    self.iteration_best_path = None
+    self.iteration_best_distance = float('inf')
+    self.iteration_paths = []
+
 
   def reset_environment(self):
     """ return to the base state of the environment
     """
     self.current_position = self.start_node
-    self.visited_nodes = [self.start_node]
-    self.current_path = []
+    self.current_distance = 0.
+    self.path.reset(self.start_node)
+
+  @property
+  def visited_nodes(self):
+    return self.path.nodes
+
+  @property
+  def current_path(self):
+    return self.path.edges()
 
   def is_visited(self, neighbor):
     """return if the neighbor has alreadey been visited
     """
-    return neighbor in self.visited_nodes   
-  
-  def get_total_distance(self, path):
-    """return the total distance of the given path
+    return self.path.is_visited(neighbor)
+
+  def move(self, new_position, edge = None):
+    """move to new_position through edge, accumulating the distance of
+    the current path
     """
-    t_distance = 0
-    for node1, node2 in path:
-      t_distance += self.graph[node1][node2]['distance']
+    if edge is None:
+      edge = self.graph.edge_id(self.current_position, new_position)
+    self.current_distance += self.graph.distance[edge]
+    self.path.append(new_position)
+    self.current_position = new_position
 
+  def get_total_distance(self, path):
+    """return the total distance of the given path (sequence of nodes)
+    """
     # At the beginning, the total distance is define by inf
-    if len(path) == 0 : t_distance = float('inf')
-    return t_distance
+    if len(path) < 2: return float('inf')
+    return self.graph.distance[get_path_edges(self.graph, path)].sum()
+
+  def process_path(self, path, cost):
+    """return a completed tour and its cost after self.postprocess
+    """
+    if self.postprocess is None:
+      return path, cost
+    if self.postprocess == 'loop_erase':
+      path = loop_erase(path, self.graph.number_of_nodes())
+    else:
+      path = shortcut_path(self.graph, path)
+    return path, self.get_total_distance(path)
+
+  def update_best_path(self, path = None, cost = None):
+    """keep the given path (the current path by default) if it is
+    shorter than the best path so far. The cost of the path is computed
+    only when it is not given
+    """
+    if path is None:
+      path, cost = self.path.nodes, self.current_distance
+    elif cost is None:
+      cost = self.get_total_distance(path)
+
+    if cost < self.best_distance:
+      self.best_distance = cost
+      self.best_path = path.copy()
+      self.best_path_edges = np.unique(get_path_edges(self.graph, self.best_path))
+
+  def store_iteration_path(self, path, cost):
+    """keep the best path of the current iteration, and every path that
+    got the target for the deposits that rank the ants of the iteration
+    """
+    if cost < self.iteration_best_distance:
+      self.iteration_best_distance = cost
+      self.iteration_best_path = path.copy()
+    if self.deposit in ('elitist', 'rank'):
+      self.iteration_paths.append((cost, np.unique(get_path_edges(self.graph, path))))
+
+  def local_evaporation(self, neighbor, edge_id = None):
+    if edge_id is None:
+      edge_id = self.graph.edge_id(self.current_position, neighbor)
+    self.graph.pheromone[edge_id] = (1 - self.local_p) * self.graph.pheromone[edge_id] + self.local_p * self.graph.tau_0
+    self.graph.mark_dirty('pheromones')
+
+  def get_reward(self, cost):
+    return self.intensity if self.intensity is not None else 1 / cost
+
+  def get_deposits(self):
+    """return the list of (edges, reward) that contribute to the
+    global update according to self.deposit
+    """
+    best_deposit = (self.best_path_edges, self.get_reward(self.best_distance))
+
+    if self.deposit == 'best_so_far':
+      return [best_deposit]
+
+    if self.deposit == 'iteration_best':
+      if self.iteration_best_path is None:
+        return []
+      edges = np.unique(get_path_edges(self.graph, self.iteration_best_path))
+      return [(edges, self.get_reward(self.iteration_best_distance))]
+
+    ranking = sorted(self.iteration_paths, key=lambda path: path[0])
+    if self.deposit == 'elitist':
+      deposits = [ (edges, self.get_reward(cost)) for cost, edges in ranking ]
+    else:
+      # rank r = 1, 2, ... of the iteration contributes with weight w - r
+      ranking = ranking[:self.elite_weight - 1]
+      deposits = [ (edges, (self.elite_weight - r) * self.get_reward(cost))
+                   for r, (cost, edges) in enumerate(ranking, start=1) ]
+
+    best_edges, best_reward = best_deposit
+    return deposits + [(best_edges, self.elite_weight * best_reward)]
+
+  def get_pheromone_bounds(self):
+    """
+    return the (tau_min, tau_max) bounds of the pheromones, None for the
+    bounds that are not defined. In mmas mode tau_max is the pheromone
+    that the best path so far converges to and
+
+      tau_min = tau_max * (1 - p_best^(1/n)) / ((avg - 1) * p_best^(1/n))
+
+    where n is the number of steps of the best path and avg the mean
+    number of options per step, the mean degree of the free nodes
+    """
+    tau_min, tau_max = self.tau_min, self.tau_max
+    if not self.mmas or self.best_distance == float('inf'):
+      return tau_min, tau_max
+
+    if tau_max is None:
+      tau_max = self.get_reward(self.best_distance)
+    if tau_min is None:
+      root = self.p_best ** (1 / max(len(self.best_path) - 1, 1))
+      degree = (self.graph.neighbors >= 0).sum(axis=1)[~self.graph.walls]
+      avg = max(degree.mean(), 2)
+      tau_min = min(tau_max * (1 - root) / ((avg - 1) * root), tau_max)
+    return tau_min, tau_max
+
+  def evaporate_and_deposit(self, deposits):
+    """
+    Global update over the whole pheromone array
 
-  def update_best_path(self):
-    if self.get_total_distance(self.current_path) < self.get_total_distance(self.best_path):
-      self.best_path = self.current_path
-  
-  def local_evaporation(self, neighbor):
-    edge = (self.current_position, neighbor)
-    self.graph.edges[edge]['pheromone'] = (1 - self.local_p) * self.graph.edges[edge]['pheromone'] + self.local_p * self.graph.tau_0
+      tau <- clip((1 - p) * tau + p * sum_k reward_k * [edge in path k], tau_min, tau_max)
+
+    :param deposits: list of (edges, reward), the edges of each path are unique
+    """
+    pheromone = self.graph.pheromone
+    self.graph.mark_dirty('pheromones')
+
+    # 1. evaporation
+    pheromone *= (1 - self.p)
+
+    # 2. contribution update, a scatter-add of the rewards over the edges
+    if len(deposits) == 1:
+      edges, reward = deposits[0]
+      pheromone[edges] += self.p * reward
+    elif len(deposits) > 1:
+      edges = np.concatenate([ edges for edges, _ in deposits ])
+      rewards = np.repeat([ reward for _, reward in deposits ],
+                          [ len(edges) for edges, _ in deposits ])
+      pheromone += self.p * np.bincount(edges, weights=rewards, minlength=pheromone.size)
+
+    # 3. bounds of the pheromones
+    tau_min, tau_max = self.get_pheromone_bounds()
+    if tau_min is not None or tau_max is not None:
+      np.clip(pheromone, tau_min, tau_max, out=pheromone)
+
+  def reset_pheromones(self):
+    """re-initialize the pheromones of the graph, to tau_max when it is
+    defined, or smooth them towards tau_max if smoothing is defined. The
+    best path so far is kept
+    """
+    pheromone = self.graph.pheromone
+    self.graph.mark_dirty('pheromones')
+    tau_max = self.get_pheromone_bounds()[1]
+    if tau_max is None:
+      pheromone[:] = self.graph.tau_0
+    elif self.smoothing is not None:
+      pheromone += self.smoothing * (tau_max - pheromone)
+    else:
+      pheromone[:] = tau_max
+
+  def get_pheromone_entropy(self):
+    """
+    Mean normalized entropy of the pheromones of the feasible edges of
+    the nodes of the best path so far with more than one feasible edge,
+    or of every such node before the first path is found. It is 1 when
+    the pheromones of every node are uniform and goes to 0 as the colony
+    converges to the best path; the nodes far from the path keep their
+    initial pheromones and would hide the convergence.
+    """
+    graph = self.graph
+    nodes = self.best_path[:-1] if self.best_path.size else np.arange(graph.number_of_nodes())
+    feasible = graph.neighbors[nodes] >= 0
+    degree = feasible.sum(axis=1)
+    branching = degree > 1
+    if not branching.any():
+      return 0.
+
+    edges = graph.edge_index[nodes[branching]]
+    pheromones = np.where(feasible[branching], graph.pheromone[edges], 0.)
+    probabilities = pheromones / pheromones.sum(axis=1, keepdims=True)
+    logs = np.log(probabilities, where=probabilities > 0, out=np.zeros_like(probabilities))
+    entropy = -(probabilities * logs).sum(axis=1) / np.log(degree[branching])
+    return entropy.mean()
 
   def offline_pheromone_update(self):
     """
     Here, it is performed two steps at the same time:
 
     1. global evaporation of the pheromone using self.p
-    2. contribution of pheromones over the best path found so far. The 
-    contribution or reward is defined according to the distance of the 
-    best path found so far. Also, if intensity is defined you could 
-    update using that constant vaue
+    2. contribution of pheromones over the paths selected by self.deposit,
+    by default the best path found so far. The contribution or reward is
+    defined according to the distance of each path. Also, if intensity is
+    defined you could update using that constant vaue
     """
-    cost = self.get_total_distance(self.best_path)
-    reward = self.intensity if self.intensity is not None else 1 / cost
-
-    #print("[INFO] Updating current path - cost: {} reward: {}".format(cost, reward))
-
-    for node1, node2, _ in self.graph.edges(data=True):
-      # 1. evaporation
-      self.graph[node1][node2]['pheromone'] = (1 - self.p) * self.graph[node1][node2]['pheromone']
+    self.evaporate_and_deposit(self.get_deposits())
 
-      # 2. contribution update
-      if (node1, node2) in self.best_path or (node2, node1) in self.best_path:
-        self.graph[node1][node2]['pheromone'] += self.p * reward
+    self.iteration_best_path = None
+    self.iteration_best_distance = float('inf')
+    self.iteration_paths = []
 
 class ACOPP(AntColonyOptimizer):
-  def __init__(self, graph, ants, alpha, beta, p, penalty, local_p = None, intensity = None, q_0 = None, proximity = 'proximity_1'):
+  def __init__(self, graph, ants, alpha, beta, p, penalty, local_p = None, intensity = None, q_0 = None, proximity = 'proximity_1',
+               backend = 'python', deposit = 'best_so_far', elite_weight = 6, postprocess = None,
+               mmas = False, tau_min = None, tau_max = None, p_best = 0.05, smoothing = None,
+               start_node = 0, target_node = None, rng = None):
     """
     Ant colony optimizer for Path Planning.  
     Traverses a graph and finds the min weight distance 
@@ -101,132 +327,572 @@ class ACOPP(AntColonyOptimizer):
     :param intensity: the amount of pheromones to add per edge (optional)
     :param q_0: probability to choose the best construction step (optional)
     :param proximity: choose what proximity measure use (optional)
+    :param backend: how the ants of an iteration are moved (optional).
+                    'python' moves one ant at a time, 'vectorized' moves
+                    all the ants in lock-step as arrays and 'numba' builds
+                    the tour of each ant in a compiled kernel (it falls back
+                    to 'python' when numba is not installed)
+    :param deposit: paths that receive pheromone in the global update (optional)
+    :param elite_weight: weight of the best path so far for the 'elitist' and
+                         'rank' deposits (optional)
+    :param postprocess: 'loop_erase' or 'shortcut' processing of the
+                        completed tours (optional)
+    :param mmas: clamp the pheromones to the Max-Min Ant System bounds (optional)
+    :param tau_min: lower bound of the pheromones (optional)
+    :param tau_max: upper bound of the pheromones (optional)
+    :param p_best: defines tau_min from tau_max in mmas mode (optional)
+    :param smoothing: pheromone trail smoothing factor of the restarts, with
+                      mmas or tau_max (optional)
+    :param start_node: node where the ants start (optional)
+    :param target_node: node that the ants look for, the bottom right corner
+                        by default (optional)
+    :param rng: numpy.random.Generator or seed of the random decisions (optional)
     """    
-    self.start_node = 0
+    if backend not in ('python', 'vectorized', 'numba'):
+      raise ValueError("Unknown backend: {}".format(backend))
+    if backend == 'numba' and not NUMBA_AVAILABLE:
+      logging.warning("numba is not installed, using the python backend")
+      backend = 'python'
+
+    self.start_node = start_node
+    self.backend = backend
     self.penalty = penalty
     self.size = graph.size
-    self.target_node = self.size * self.size - 1
+    self.target_node = self.size * self.size - 1 if target_node is None else target_node
     self.list_distances = []
+    self.iteration = 0
     self.proximity = proximity
+    self.colony_visits = None
+
+    super().__init__(graph, ants, alpha, beta, p, local_p, intensity, q_0,
+                     deposit, elite_weight, postprocess,
+                     mmas, tau_min, tau_max, p_best, smoothing, rng)
 
-    super().__init__(graph, ants, alpha, beta, p, local_p, intensity, q_0)
+    self.graph.set_state(self.target_node, State.target)
 
-    self.graph.nodes[self.graph.size * self.graph.size - 1]['state'] = State.target
+    # ((1 - penalty) * tau)^alpha = (1 - penalty)^alpha * tau^alpha, so the
+    # penalty is applied over the cached attractiveness
+    self.penalty_factor = (1 - self.penalty) ** self.alpha
+    self.refresh_attractiveness()
+
+  def set_query(self, start_node, target_node):
+    """
+    Move the colony to a new (start_node, target_node) query over the same
+    lattice. The best path so far is dropped and the pheromones are kept,
+    the heuristic tables of the graph are cached per target.
+    """
+    if self.graph.walls[start_node] or self.graph.walls[target_node]:
+      raise ValueError("The query ({}, {}) has a wall".format(start_node, target_node))
+
+    self.start_node = start_node
+    self.target_node = target_node
+    self.graph.set_state(target_node, State.target)
+    self.list_distances = []
+    self.reset_best_path()
+    self.reset_environment()
+    self.refresh_attractiveness()
+
+  def solve_queries(self, queries, total_iter, warm_start = False, **fit_params):
+    """
+    Answer a batch of (start_node, target_node) queries with the same
+    colony, one after the other.
+    :param queries:    sequence of (start_node, target_node) pairs
+    :param total_iter: iterations of fit per query
+    :param warm_start: if True each query starts from the pheromones left
+                       by the last one, otherwise from the pheromones that
+                       the graph had before the first query. The trails
+                       of an unrelated query can mislead the ants, so a
+                       steps_die limit is advised with warm starts
+    :param fit_params: other parameters of fit (steps_die, patience, ...)
+    :return: list with a dict per query with its nodes, best path, best
+             distance and the history of fit
+    """
+    initial_pheromone = self.graph.pheromone.copy()
+    results = []
+
+    for start_node, target_node in queries:
+      if not warm_start:
+        self.graph.pheromone[:] = initial_pheromone
+        self.graph.mark_dirty()
+      self.set_query(start_node, target_node)
+      history = self.fit(total_iter, **fit_params)
+
+      results.append({
+          "start_node"    : start_node,
+          "target_node"   : target_node,
+          "best_path"     : self.best_path.copy(),
+          "best_distance" : self.best_distance,
+          "history"       : history
+      })
+
+    return results
+
+  def get_optimal_distance(self):
+    """return the exact shortest distance of the query, inf if the target
+    is not reachable. It is cached by the graph per map and query
+    """
+    return self.graph.get_shortest_path(self.start_node, self.target_node)[1]
+
+  def get_optimality_gap(self, distance, optimal_distance = None):
+    """return the relative gap (distance - optimal) / optimal of a distance
+    of the query, inf while no ant got the target and nan if the target
+    is not reachable
+    """
+    optimal_distance = self.get_optimal_distance() if optimal_distance is None else optimal_distance
+    if not np.isfinite(optimal_distance):
+      return np.nan
+    if optimal_distance == 0:
+      return 0. if distance == 0 else np.inf
+    return float((distance - optimal_distance) / optimal_distance)
+
+  def save_checkpoint(self, filename, history = None, last_improvement = 0,
+                      last_restart = 0, stopped = False):
+    """
+    Save the state of the colony in the compressed npz file filename: the
+    pheromones and counters of the graph, the best path, the iteration
+    counter, the state of the random generator (with the block of uniform
+    numbers in use) and the progress of fit. The file is written to a
+    temporal file first, so a killed job never leaves half a checkpoint.
+    :param history: history of the running fit (optional)
+    """
+    history = history or {}
+    arrays = {
+        "pheromone"        : self.graph.pheromone,
+        "counter"          : self.graph.counter,
+        "walls"            : np.packbits(self.graph.walls),
+        "start_node"       : self.start_node,
+        "target_node"      : self.target_node,
+        "best_path"        : self.best_path,
+        "best_distance"    : self.best_distance,
+        "iteration"        : self.iteration,
+        "list_distances"   : np.array(self.list_distances, dtype=float),
+        "rng_state"        : json.dumps(self.rng.bit_generator.state),
+        "uniforms_block"   : self.uniforms.block,
+        "uniforms_index"   : self.uniforms.index,
+        "last_improvement" : last_improvement,
+        "last_restart"     : last_restart,
+        "stopped"          : stopped,
+    }
+    for key, values in history.items():
+      arrays["history_" + key] = np.array(values)
+
+    tmp_file = filename + ".tmp"
+    with open(tmp_file, "wb") as f:
+      np.savez_compressed(f, **arrays)
+    os.replace(tmp_file, filename)
+
+  def load_checkpoint(self, filename, warm_start = False):
+    """
+    Restore the state of the colony saved by save_checkpoint.
+    :param warm_start: if True only the pheromones are restored, e.g. from
+                       the run of another map with the same size
+    :return: dict with the progress of fit ('history', 'last_improvement',
+             'last_restart', 'stopped'), None for a warm start
+    """
+    with np.load(filename) as checkpoint:
+      if checkpoint["pheromone"].size != self.graph.number_of_edges():
+        raise ValueError("The checkpoint {} has another lattice size".format(filename))
+
+      if warm_start:
+        self.graph.pheromone[:] = checkpoint["pheromone"]
+        self.graph.mark_dirty()
+        self.refresh_attractiveness()
+        return None
+
+      walls = np.unpackbits(checkpoint["walls"], count=self.graph.number_of_nodes())
+      if not np.array_equal(walls.astype(bool), self.graph.walls):
+        raise ValueError("The checkpoint {} belongs to another map".format(filename))
+
+      self.set_query(int(checkpoint["start_node"]), int(checkpoint["target_node"]))
+      self.graph.pheromone[:] = checkpoint["pheromone"]
+      self.graph.counter[:] = checkpoint["counter"]
+      self.graph.mark_dirty()
+      self.update_best_path(checkpoint["best_path"], float(checkpoint["best_distance"]))
+      self.iteration = int(checkpoint["iteration"])
+      self.list_distances = checkpoint["list_distances"].tolist()
+
+      self.rng.bit_generator.state = json.loads(str(checkpoint["rng_state"]))
+      self.uniforms.block = checkpoint["uniforms_block"]
+      self.uniforms.index = int(checkpoint["uniforms_index"])
+      self.refresh_attractiveness()
+
+      return {
+          "history"          : { key[len("history_"):]: checkpoint[key].tolist()
+                                 for key in checkpoint.files if key.startswith("history_") },
+          "last_improvement" : int(checkpoint["last_improvement"]),
+          "last_restart"     : int(checkpoint["last_restart"]),
+          "stopped"          : bool(checkpoint["stopped"]),
+      }
+
+  def refresh_attractiveness(self, edges = None):
+    """
+    Update the cache of the attractiveness tau^alpha * eta^beta of each
+    (node, slot) of the lattice, for the given edges or for all of them.
+    The heuristic term eta^beta is static, so it is computed only in the
+    full refresh.
+    """
+    graph = self.graph
+    if edges is None:
+      heuristic = graph.get_heuristic(self.target_node, self.proximity)
+      self.eta_beta = heuristic ** self.beta
+      tau_alpha = np.where(graph.edge_index >= 0, graph.pheromone[graph.edge_index], 0.) ** self.alpha
+      self.attractiveness = tau_alpha * self.eta_beta
+    else:
+      # put and take index the (N, 4) tables as flat arrays
+      slots = graph.edge_slots[edges]
+      tau_alpha = np.power(graph.pheromone[edges], self.alpha)[..., None]
+      self.attractiveness.put(slots, tau_alpha * self.eta_beta.take(slots))
+
+  def local_evaporation(self, neighbor, edge_id = None):
+    if edge_id is None:
+      edge_id = self.graph.edge_id(self.current_position, neighbor)
+    super().local_evaporation(neighbor, edge_id)
+    self.refresh_attractiveness(edge_id)
+
+  def offline_pheromone_update(self):
+    super().offline_pheromone_update()
+    self.refresh_attractiveness()
+
+  def reset_pheromones(self):
+    super().reset_pheromones()
+    self.refresh_attractiveness()
 
   def update_state(self, mode = 'proximity_1', 
                    normalization = None,
                    mean = 0, 
                    std = 1, 
                    distance = 'euclidean'):
-    neighbors = self.graph[self.current_position]
-
-    # Process to get the weight of each neighbor
-    weights = []
-    aux_weights = []
-    neighbors_idx = []
-    for neighbor_node, edge in neighbors.items():
-      if self.graph.nodes[neighbor_node]['state'] != State.wall:
-          proximity = get_proximity(self.graph, 
-                                    self.current_position,
-                                    neighbor_node,
-                                    self.target_node,
-                                    mode,
-                                    distance)
-          if normalization is not None:
-            proximity = (proximity - mean) / std      
-
-          if not self.is_visited(neighbor_node):
-            # get the weight per neighbor and append it
-            weights.append( (edge['pheromone'] ** self.alpha) * 
-                          (proximity ** self.beta))
-            aux_weights.append( edge['pheromone'] * 
-                          (proximity ** self.beta))
-            neighbors_idx.append(neighbor_node)
-          else:
-            penalty_pheromone = (1 - self.penalty) * edge['pheromone']
-            weights.append( (penalty_pheromone ** self.alpha) * 
-                  (proximity ** self.beta))
-            aux_weights.append( penalty_pheromone * 
-                          (proximity ** self.beta))
-            neighbors_idx.append(neighbor_node)
-    
-    acu_weight = sum(weights)
-    probabilities = np.array(weights)/acu_weight
-    #print("[INFO] probabilities: {}".format(probabilities))
+    neighbors = self.graph.neighbors[self.current_position]
+    edges = self.graph.edge_index[self.current_position]
+
+    # Process to get the weight of each neighbor, the walls and the
+    # borders of the lattice are not in the neighbor table
+    feasible = neighbors >= 0
+    neighbors_idx = neighbors[feasible]
+    edges_idx = edges[feasible]
+    pheromones = self.graph.pheromone[edges_idx]
+
+    if mode == self.proximity and normalization is None and distance == 'euclidean':
+      # cached tau^alpha * eta^beta and eta^beta of the neighbors
+      weights = self.attractiveness[self.current_position][feasible]
+      heuristic = self.eta_beta[self.current_position][feasible]
+    else:
+      heuristic = self.graph.get_heuristic(self.target_node, mode, distance)
+      proximities = heuristic[self.current_position][feasible]
+      if normalization is not None:
+        proximities = (proximities - mean) / std
+      heuristic = proximities ** self.beta
+      weights = (pheromones ** self.alpha) * heuristic
+
+    # the pheromone of the already visited neighbors is penalized
+    visited = self.path.visited_mask(neighbors_idx)
+    weights = np.where(visited, self.penalty_factor * weights, weights)
 
-    # with probability q_0 select the best trial
-    if self.q_0 is not None and np.random.rand() < self.q_0:
-        new_position = neighbors_idx[np.argmax(aux_weights)]
+    # with probability q_0 select the best trial, also when all the
+    # weights underflow to 0
+    exploit = self.q_0 is not None and self.uniforms.next() < self.q_0
+    if exploit or not (weights > 0).any():
+        pheromones = np.where(visited, (1 - self.penalty) * pheromones, pheromones)
+        choice = np.argmax(pheromones * heuristic)
     else:
       # choose an option following the wheel selection algorithm  
-      new_position = np.random.choice(neighbors_idx, p=probabilities)
+      choice = roulette_wheel(weights, self.uniforms.next())
+    new_position = neighbors_idx[choice]
 
     # perform local evaporation
     if self.local_p is not None:
-      self.local_evaporation(new_position)
+      self.local_evaporation(new_position, edges_idx[choice])
 
-    self.graph.nodes[self.current_position]['counter'] += 1
-     
-    self.current_path.append((self.current_position, new_position))
-    self.visited_nodes.append(new_position)
-    self.current_position = new_position
+    self.graph.counter[self.current_position] += 1
+    self.graph.mark_dirty('exploration')
+
+    self.move(new_position, edges_idx[choice])
+
+  def run_ants_sequential(self, steps_die = None):
+    """Move the ants of one iteration one after the other and return
+    the distance of the path of each ant
+    """
+    distance_per_ants = []
+
+    for ant in range(self.ants):
+      get_target = False
+      is_stuck = False
+      step = 0
+      while not get_target and not is_stuck:
+        self.update_state(mode=self.proximity)
+        step += 1
+
+        if steps_die == step:
+          is_stuck = True
+        get_target = self.end_route()
+        if get_target: self.graph.counter[self.current_position] += 1
+
+      current_distance = self.current_distance
+      if not is_stuck:
+          path, cost = self.process_path(self.path.nodes, current_distance)
+          self.update_best_path(path, cost)
+          self.store_iteration_path(path, cost)
+          is_stuck = False
+      #print("[INFO] ant: {} current: {}".format(ant, current_distance))
+      distance_per_ants.append(current_distance)
+      self.reset_environment()
+
+    return distance_per_ants
+
+  def run_ants_numba(self, steps_die = None):
+    """Move the ants of one iteration one after the other, building the
+    tour of each ant in the compiled kernel construct_tour, and return
+    the distance of the path of each ant
+    """
+    graph = self.graph
+    distance_per_ants = []
+
+    for ant in range(self.ants):
+      path, length, current_distance, arrived = construct_tour(
+          graph.neighbors, graph.edge_index, graph.edge_slots,
+          graph.pheromone, graph.distance, graph.counter,
+          self.attractiveness, self.eta_beta,
+          self.start_node, self.target_node,
+          self.alpha, self.penalty,
+          -1. if self.q_0 is None else self.q_0,
+          -1. if self.local_p is None else self.local_p,
+          graph.tau_0,
+          -1 if steps_die is None else steps_die,
+          self.path.stamps, self.path.stamp, self.path.buffer,
+          self.rng.integers(2**31))
+
+      graph.mark_dirty()
+      self.path.buffer = path
+      self.path.length = length
+      self.current_position = path[length - 1]
+      self.current_distance = current_distance
+
+      if arrived:
+        path, cost = self.process_path(self.path.nodes, current_distance)
+        self.update_best_path(path, cost)
+        self.store_iteration_path(path, cost)
+      distance_per_ants.append(current_distance)
+      self.reset_environment()
+
+    return distance_per_ants
+
+  def run_ants_vectorized(self, steps_die = None):
+    """Move all the ants of one iteration in lock-step and return the
+    distance of the path of each ant.
+
+    The transition rule, the penalty of visited nodes and the q_0
+    exploitation are the same as in update_state, but they are computed
+    for every ant at once. The local evaporation is applied after each
+    step of the colony, so an edge chosen by several ants in the same
+    step evaporates only once.
+    """
+    graph = self.graph
+    ants = np.arange(self.ants)
+
+    positions = np.full(self.ants, self.start_node)
+    alive = np.ones(self.ants, dtype=bool)
+    arrived = np.zeros(self.ants, dtype=bool)
+    costs = np.zeros(self.ants)
+    lengths = np.zeros(self.ants, dtype=int)
+    if self.colony_visits is None:
+      self.colony_visits = VisitStamps(self.ants, graph.number_of_nodes())
+    visited = self.colony_visits
+    visited.reset(self.start_node)
+    paths = np.empty((self.ants, 4 * self.size), dtype=np.int32)
+    paths[:, 0] = self.start_node
+
+    step = 0
+    while alive.any():
+      moving = ants[alive]
+      current = positions[moving]
+      neighbors = graph.neighbors[current]
+      edges = graph.edge_index[current]
+
+      # the walls and the borders of the lattice are not in the neighbor
+      # table, an ant without feasible neighbors is stuck
+      feasible = neighbors >= 0
+      is_stuck = ~feasible.any(axis=1)
+      if is_stuck.any():
+        alive[moving[is_stuck]] = False
+        continue
+
+      # cached tau^alpha * eta^beta, the visited neighbors are penalized
+      is_visited = visited.is_visited(moving[:, None], neighbors)
+      weights = np.where(feasible, self.attractiveness[current], 0.)
+      weights = np.where(is_visited, self.penalty_factor * weights, weights)
+
+      heuristic = np.where(feasible, self.eta_beta[current], 0.)
+      pheromones = np.where(feasible, graph.pheromone[edges], 0.)
+      pheromones = np.where(is_visited, (1 - self.penalty) * pheromones, pheromones)
+      aux_weights = np.where(feasible, pheromones * heuristic, -np.inf)
+
+      # wheel selection for every ant with a single uniform draw, when all
+      # the weights of an ant underflow to 0 it takes the best trial among
+      # its feasible neighbors
+      choice = roulette_wheel(weights, self.rng.random(moving.size))
+      no_weight = ~(weights > 0).any(axis=1)
+      choice[no_weight] = np.argmax(aux_weights[no_weight], axis=1)
+
+      # with probability q_0 select the best trial
+      if self.q_0 is not None:
+        exploit = self.rng.random(moving.size) < self.q_0
+        choice[exploit] = np.argmax(aux_weights[exploit], axis=1)
+
+      rows = np.arange(moving.size)
+      new_positions = neighbors[rows, choice]
+      new_edges = edges[rows, choice]
+
+      # perform local evaporation
+      if self.local_p is not None:
+        graph.pheromone[new_edges] = (1 - self.local_p) * graph.pheromone[new_edges] + self.local_p * graph.tau_0
+        self.refresh_attractiveness(new_edges)
+
+      np.add.at(graph.counter, current, 1)
+
+      if lengths.max() + 1 >= paths.shape[1]:
+        paths = np.concatenate([paths, np.empty_like(paths)], axis=1)
+      lengths[moving] += 1
+      paths[moving, lengths[moving]] = new_positions
+      costs[moving] += graph.distance[new_edges]
+      visited.mark(moving, new_positions)
+      positions[moving] = new_positions
+      step += 1
+
+      get_target = new_positions == self.target_node
+      np.add.at(graph.counter, new_positions[get_target], 1)
+      graph.mark_dirty()
+      alive[moving[get_target]] = False
+      if steps_die == step:
+        alive[:] = False
+      else:
+        arrived[moving[get_target]] = True
+
+    completed = [ self.process_path(paths[ant, :lengths[ant] + 1], costs[ant])
+                  for ant in np.flatnonzero(arrived) ]
+
+    # the best ant of the iteration competes with the best path so far
+    if completed:
+      self.update_best_path(*min(completed, key=lambda tour: tour[1]))
+
+    for path, cost in completed:
+      self.store_iteration_path(path, cost)
+
+    return list(costs)
 
   def end_route(self):
     return self.current_position == self.target_node
 
-  def fit(self, total_iter, steps_die = None, iter_show = 10):
+  def fit(self, total_iter, steps_die = None, iter_show = 10, patience = None,
+          target_distance = None, entropy_threshold = None, restart_patience = None,
+          checkpoint = None, checkpoint_iter = 10, recorder = None):
+    """
+    Run the colony for total_iter iterations at most and return the
+    history of the distances, with the exact shortest distance of the
+    query (optimal_distance) and the relative gap of the best distance to
+    it in each iteration (optimality_gap). The run stops early when:
+      - the best distance has not improved for patience iterations
+      - the best distance reaches target_distance, 'optimal' for the
+        exact shortest distance
+      - the pheromone entropy (get_pheromone_entropy) falls below
+        entropy_threshold
+    :param restart_patience: iterations without improvement, counted from
+                             the last restart, after which the pheromones
+                             are re-initialized as in MMAS (optional)
+    :param checkpoint: npz file where the state of the colony is saved every
+                       checkpoint_iter iterations. If the file exists, the
+                       run is resumed from it (optional)
+    :param recorder: FrameRecorder that takes a snapshot of the graph after
+                     each iteration (optional)
+    """
     # define 2 draw_mode per_iteration or per_ants
-    list_distances = []
-    list_distances_avg = []
-    list_distances_std = []
-    list_distances_sem = []
+    history = {
+        "distances_best" : [],
+        "distances_avg"  : [],
+        "distances_std"  : [],
+        "distances_sem"  : [],
+        "optimality_gap" : [],
+        "restarts"       : []
+    }
+    last_improvement = 0
+    last_restart = 0
+
+    if checkpoint is not None and os.path.exists(checkpoint):
+      progress = self.load_checkpoint(checkpoint)
+      history.update(progress["history"])
+      last_improvement = progress["last_improvement"]
+      last_restart = progress["last_restart"]
+      logging.info("resuming from {} at iter: {}".format(checkpoint, len(history["distances_best"])))
+      if progress["stopped"]:
+        return history
+
+    list_distances = history["distances_best"]
+    list_distances_avg = history["distances_avg"]
+    list_distances_std = history["distances_std"]
+    list_distances_sem = history["distances_sem"]
+    optimality_gap = history["optimality_gap"]
+    restarts = history["restarts"]
+
+    optimal_distance = self.get_optimal_distance()
+    history["optimal_distance"] = optimal_distance
+    if target_distance == 'optimal':
+      target_distance = optimal_distance
+
+    # the pheromones could have changed since the last run (e.g. bootstrapping)
+    self.refresh_attractiveness()
     
-    for iter in range(total_iter):
-
-      distance_per_ants = []
-
-      for ant in range(self.ants):
-        get_target = False
-        is_stuck = False
-        step = 0
-        while not get_target and not is_stuck:
-          self.update_state(mode=self.proximity)     
-          step += 1
-            
-          if steps_die == step: 
-            is_stuck = True
-          get_target = self.end_route()
-          if get_target: self.graph.nodes[self.current_position]['counter'] += 1
-          
-        if not is_stuck: 
-            self.update_best_path()
-            is_stuck = False
-        current_distance = self.get_total_distance(self.current_path)
-        #print("[INFO] iter: {} ant: {} current: {}".format(iter, ant, current_distance))
-        distance_per_ants.append(current_distance)
-        self.reset_environment()
+    for iter in range(len(list_distances), total_iter):
+
+      if self.backend == 'vectorized':
+        distance_per_ants = self.run_ants_vectorized(steps_die)
+      elif self.backend == 'numba':
+        distance_per_ants = self.run_ants_numba(steps_die)
+      else:
+        distance_per_ants = self.run_ants_sequential(steps_die)
 
       self.offline_pheromone_update()
 
       # Track the best distance so far
-      best_distance = self.get_total_distance(self.best_path)
+      best_distance = self.best_distance
       if iter % iter_show == 0:
         logging.info("iter: {} best: {:.2f} d_mean: {:.2f} d_stdv: {:.2f} d_sem: {:.2f}".format(iter, 
                                                               best_distance, 
                                                               np.mean(distance_per_ants),
                                                               np.std(distance_per_ants),
                                                               np.std(distance_per_ants, ddof=1) / np.sqrt(np.size(distance_per_ants))))
+      if list_distances and best_distance < list_distances[-1]:
+        last_improvement = iter
       list_distances.append(best_distance)
       list_distances_avg.append(np.mean(distance_per_ants))
       list_distances_std.append(np.std(distance_per_ants))
       list_distances_sem.append(np.std(distance_per_ants, ddof=1) / np.sqrt(np.size(distance_per_ants)))
+      optimality_gap.append(self.get_optimality_gap(best_distance, optimal_distance))
       self.list_distances.append(best_distance)
+      self.iteration += 1
+      if recorder is not None:
+        recorder.record(self.graph, iter)
 
-    history = {
-        "distances_best" : list_distances,
-        "distances_avg"  : list_distances_avg,
-        "distances_std"  : list_distances_std,
-        "distances_sem"  : list_distances_sem
-    }
+      stop = None
+      # the distances of the paths are sums, so they are compared up to
+      # the round off
+      if target_distance is not None and (best_distance <= target_distance or
+                                          np.isclose(best_distance, target_distance)):
+        stop = "target distance reached"
+      elif patience is not None and iter - last_improvement >= patience:
+        stop = "no improvement in {} iterations".format(patience)
+      elif entropy_threshold is not None and self.get_pheromone_entropy() < entropy_threshold:
+        stop = "pheromone entropy below {}".format(entropy_threshold)
+
+      if stop is None and restart_patience is not None and iter - max(last_improvement, last_restart) >= restart_patience:
+        logging.info("iter: {} restart of the pheromones".format(iter))
+        self.reset_pheromones()
+        restarts.append(iter)
+        last_restart = iter
+
+      if checkpoint is not None and (stop is not None or (iter + 1) % checkpoint_iter == 0 or iter + 1 == total_iter):
+        self.save_checkpoint(checkpoint, history, last_improvement, last_restart, stop is not None)
+
+      if stop is not None:
+        logging.info("iter: {} {}".format(iter, stop))
+        break
 
     return history
@@ -2,6 +2,11 @@ import networkx as nx
 import matplotlib.pyplot as plt
 import numpy as np
 import enum
+from collections import OrderedDict
+from utils.measures import get_proximity_table
+from utils.maps import load_occupancy
+from utils.maze import generate_maze
+from utils.paths import get_shortest_path
 
 # creating enumerations for status of a each node
 # the number associated represent a mark to display
@@ -11,109 +16,390 @@ class State(enum.Enum):
     wall = 0.1
     target = 0.5
 
+# slots of the neighbor table, each node has at most four neighbors
+UP, DOWN, LEFT, RIGHT = range(4)
+# heuristic tables kept by a graph, each one is (N, 4) floats
+HEURISTICS_CACHE_SIZE = 4
+DIRECTIONS = ("up", "down", "left", "right")
+
 #Class to define the environment
-class PPGraph(nx.Graph):
-  def __init__(self, size, tau_0, filename = None):
+class PPGraph():
+  def __init__(self, size, tau_0, filename = None, walls = None, mmap = False):
     """Define a graph environment given a size
     and tau_0 (initial pheromone).
-    The obstacle are loaded from filename
+    The obstacles are loaded from the map filename (any format of
+    utils.maps.load_occupancy, memory-mapped if mmap) or given as the
+    occupancy array walls.
+
+    The lattice is stored as arrays instead of dicts:
+      neighbors:  (N, 4) neighbor per direction slot, -1 if there is none
+                  or if the node or the neighbor is a wall
+      edge_index: (N, 4) id of the edge per direction slot, -1 in the same
+                  slots as neighbors
+      edge_slots: (E, 2) flat index of the two slots of each edge in the (N, 4) tables
+      edge_nodes: (E, 2) end nodes of each undirected edge
+      pheromone, distance: (E,) attributes per edge
+      pos, walls, counter: (N, 2), (N,), (N,) attributes per node
     """
     self.size = size
     self.tau_0 = tau_0
-    nx.Graph.__init__(self)
-    
-    self.__create_graph(filename)
-    
-  def __create_graph(self, filename):
+    self.target_node = None
+    self.heuristics = OrderedDict()
+    self.shortest_paths = {}
+    # counter of the changes of the walls, for the caches of other objects
+    self.walls_version = 0
+    # matrices for visualization, cached until the pheromones or the
+    # counters change. The code that writes them calls mark_dirty
+    self.matrices = {}
+
+    if filename is not None:
+      walls = load_occupancy(filename, size, mmap)
+    self.__create_graph(walls)
+
+  @classmethod
+  def from_maze(cls, size, tau_0, method = 'backtracker', start_node = 0,
+                target_node = None, rng = None, **params):
+    """Create a graph environment with a random map of utils.maze, e.g.
+    PPGraph.from_maze(50, 0.1, 'prim', rng=seed). The start_node and
+    target_node are connected; the other params go to generate_maze
+    """
+    walls = generate_maze(size, method, start_node, target_node, rng=rng, **params)
+    return cls(size, tau_0, walls=walls)
+
+  def __create_graph(self, walls):
     """Create a square lattice graph with size x size nodes.
+    The node 0 is the top left corner and the ids grow row by row.
+    """
+    n_nodes = self.size * self.size
+    nodes = np.arange(n_nodes, dtype=np.int32)
+    row, col = np.divmod(nodes, self.size)
+
+    self.pos = np.stack([col, self.size - 1 - row], axis=1)
+    self.walls = np.zeros(n_nodes, dtype=bool)
+    self.counter = np.zeros(n_nodes, dtype=np.int64)
+
+    self.__adding_edges(nodes, row, col)
+
+    if walls is not None:
+      self.set_walls(walls)
+
+  def __adding_edges(self, nodes, row, col):
+    """Defines the neighbors per node"""
+    # horizontal edges (n, n + 1) and vertical edges (n, n + size),
+    # the border nodes have not the connections out of the lattice
+    horizontal = nodes[col < self.size - 1]
+    vertical = nodes[row < self.size - 1]
+
+    self.edge_nodes = np.concatenate([
+        np.stack([horizontal, horizontal + 1], axis=1),
+        np.stack([vertical, vertical + self.size], axis=1)])
+
+    self.neighbors, self.edge_index = self.get_lattice_slots(nodes)
+
+    self.edge_slots = np.concatenate([
+        np.stack([4 * horizontal + RIGHT, 4 * (horizontal + 1) + LEFT], axis=1),
+        np.stack([4 * vertical + DOWN, 4 * (vertical + self.size) + UP], axis=1)])
+
+    self.pheromone = np.full(len(self.edge_nodes), self.tau_0, dtype=float)
+    self.distance = np.ones(len(self.edge_nodes), dtype=float)
+
+  def get_lattice_slots(self, nodes):
+    """return the (n, 4) neighbors and edge ids of nodes in the lattice
+    without walls, -1 out of the borders. The horizontal edge (n, n + 1)
+    has the id n - row and the vertical edge (n, n + size) the id
+    n + number of horizontal edges, so they are computed without tables.
+    """
+    nodes = np.asarray(nodes, dtype=np.int32)
+    row, col = np.divmod(nodes, self.size)
+    n_horizontal = self.size * (self.size - 1)
+
+    neighbors = np.empty((nodes.size, 4), dtype=np.int32)
+    edge_index = np.empty((nodes.size, 4), dtype=np.int32)
+    for slot, exists, step, edge in [
+        (UP, row > 0, -self.size, nodes - self.size + n_horizontal),
+        (DOWN, row < self.size - 1, self.size, nodes + n_horizontal),
+        (LEFT, col > 0, -1, nodes - 1 - row),
+        (RIGHT, col < self.size - 1, 1, nodes - row)]:
+      neighbors[:, slot] = np.where(exists, nodes + step, -1)
+      edge_index[:, slot] = np.where(exists, edge, -1)
+    return neighbors, edge_index
+
+  def set_walls(self, walls):
+    """set the occupancy of the whole lattice from the boolean array walls
+    (flat or (size, size)) and rebuild the neighbor tables at once
+    """
+    self.walls[:] = np.asarray(walls, dtype=bool).reshape(self.number_of_nodes())
+    self.__mask_walls(np.arange(self.number_of_nodes()))
+    self.walls_version += 1
+    self.invalidate_heuristics()
+    self.mark_dirty('pheromones')
+
+  def __mask_walls(self, nodes):
+    """rebuild the rows of nodes of the neighbor tables, the slots of the
+    walls and of the neighbors that are walls are removed
+    """
+    neighbors, edge_index = self.get_lattice_slots(nodes)
+    blocked = (neighbors < 0) | self.walls[neighbors] | self.walls[nodes][:, None]
+    self.neighbors[nodes] = np.where(blocked, -1, neighbors)
+    self.edge_index[nodes] = np.where(blocked, -1, edge_index)
+
+  def number_of_nodes(self):
+    return self.size * self.size
+
+  def number_of_edges(self):
+    return len(self.edge_nodes)
+
+  def edge_id(self, node1, node2):
+    """return the id of the lattice edge between node1 and node2, the
+    edges of the walls included
+    """
+    low, high = min(node1, node2), max(node1, node2)
+    if 0 <= low and high < self.number_of_nodes():
+      if high - low == self.size:
+        return low + self.size * (self.size - 1)
+      if high - low == 1 and high % self.size:
+        return low - low // self.size
+    raise KeyError((node1, node2))
+
+  def get_heuristic(self, target_node, mode = 'proximity_1', distance = 'euclidean'):
+    """return the (N, 4) table with the proximity of each neighbor slot
+    to target_node. The tables are built once per target, mode and
+    distance, and they are dropped whenever the walls change. Only the
+    HEURISTICS_CACHE_SIZE tables used last are kept, so answering many
+    queries on the same map does not pile them up
+    """
+    key = (target_node, mode, distance)
+    if key in self.heuristics:
+      self.heuristics.move_to_end(key)
+    else:
+      self.heuristics[key] = get_proximity_table(self, target_node, mode, distance)
+      while len(self.heuristics) > HEURISTICS_CACHE_SIZE:
+        self.heuristics.popitem(last=False)
+    return self.heuristics[key]
+
+  def get_shortest_path(self, start_node, target_node):
+    """return the exact shortest (path, cost) from start_node to
+    target_node, cost is inf if there is none. They are computed once per
+    start and target, and they are dropped whenever the walls or the
+    distances change. The returned path is read only
+    """
+    key = (start_node, target_node)
+    if key not in self.shortest_paths:
+      path, cost = get_shortest_path(self, start_node, target_node)
+      path.flags.writeable = False
+      self.shortest_paths[key] = (path, float(cost))
+    return self.shortest_paths[key]
+
+  def invalidate_heuristics(self):
+    """drop the heuristic tables and the shortest paths, they depend on the walls"""
+    self.heuristics = OrderedDict()
+    self.shortest_paths = {}
+
+  def mark_dirty(self, *matrices):
+    """drop the cached 'pheromones' and/or 'exploration' matrices, all of
+    them by default
+    """
+    for matrix in matrices or tuple(self.matrices):
+      self.matrices.pop(matrix, None)
+
+  def get_state(self, node):
+    if self.walls[node]:
+      return State.wall
+    if node == self.target_node:
+      return State.target
+    return State.free
+
+  def set_state(self, node, state):
+    if self.walls[node] != (state == State.wall):
+      self.walls[node] = state == State.wall
+      lattice_neighbors, _ = self.get_lattice_slots([node])
+      self.__mask_walls(np.append(lattice_neighbors[lattice_neighbors >= 0], node))
+      self.walls_version += 1
+      self.invalidate_heuristics()
+      self.mark_dirty('pheromones')
+    if state == State.target:
+      self.target_node = node
+    elif node == self.target_node:
+      self.target_node = None
+
+  def get_state_array(self):
+    """return the value of the State of each node
     """
-    
-    walls = np.load(filename) if filename is not None else []
-        
-    if self.size + 1 in walls: print("What happend?")
-        
-    self.clear() # Remove all the nodes and edges of the last graph
-    current_node = 0
-    for j in range(self.size - 1, -1, -1):
-      for i in range(self.size):  
-
-          #Adding neighbors to the current node
-          self.__adding_edges(i,j,current_node, self.tau_0)
-
-          #Adding the node to the network
-          self.add_node(current_node, pos=(i,j), state = State.free, counter = 0)
-        
-          current_node += 1
-            
-    for wall_id in walls:
-        self.nodes[wall_id]['state'] = State.wall
-            
-            
-  def __adding_edges(self,i,j,current_node, tau_0):
-    """Defines the neighbors per current node"""
-    #There are four possible connection
-    directions = {
-        "up" : current_node - self.size,
-        "down" : current_node + self.size,
-        "left" : current_node - 1,
-        "right" : current_node + 1
-    }
-
-    #For border cases of the network, we have to pop some connections
-    if i == 0:
-      directions.pop("left")
-    if i == self.size - 1:
-      directions.pop("right")
-    if j == 0:
-      directions.pop("down")
-    if j == self.size - 1:
-      directions.pop("up")
-
-    for _, neighbor in directions.items():
-      # adding edge      
-      self.add_edge(current_node, neighbor, 
-                    pheromone = tau_0, 
-                    distance = 1)
+    states = np.where(self.walls, State.wall.value, State.free.value)
+    if self.target_node is not None:
+      states[self.target_node] = State.target.value
+    return states
+
+  # networkx like access to the attributes of the nodes and edges,
+  # e.g. graph.nodes[i]['state'], graph[i][j]['pheromone'],
+  # graph.edges[(i, j)]['pheromone']
+  @property
+  def nodes(self):
+    return _NodeView(self)
+
+  @property
+  def edges(self):
+    return _EdgeView(self)
+
+  def __getitem__(self, node):
+    # the adjacency of the lattice, the walls included like in to_networkx
+    neighbors, edge_index = self.get_lattice_slots([node])
+    return {neighbor: _EdgeAttributes(self, edge_id)
+            for neighbor, edge_id in zip(neighbors[0], edge_index[0])
+            if neighbor >= 0}
 
+  def __iter__(self):
+    return iter(range(self.number_of_nodes()))
+
+  def __len__(self):
+    return self.number_of_nodes()
+
+  def to_networkx(self):
+    """return a networkx copy of the graph, useful to draw or to use
+    the networkx algorithms
+    """
+    graph = nx.Graph()
+    for node in self:
+      graph.add_node(node, pos=tuple(self.pos[node]), state=self.get_state(node),
+                     counter=self.counter[node])
+    for edge_id, (node1, node2) in enumerate(self.edge_nodes):
+      graph.add_edge(node1, node2,
+                     pheromone=self.pheromone[edge_id],
+                     distance=self.distance[edge_id])
+    return graph
 
   #Function to plot the structure of the graph
   def draw_graph(self, node_size=25, with_labels=False):
     """
     Draw the graph.
-        
+
     node_size: the size of all the nodes
     node_color: the color of all the nodes
     with_labels: True or False to show the ids of the nodes
     """
     fig, ax = plt.subplots()
     ax.set_aspect('equal') #set the x and y axes to the same scale
-    pos = nx.get_node_attributes(self, 'pos')
-    color_values = [ self.nodes[i]['state'].value for i in self.nodes() ]
-    nx.draw(self, pos, cmap = plt.get_cmap('viridis'), node_color=color_values\
+    graph = self.to_networkx()
+    pos = nx.get_node_attributes(graph, 'pos')
+    color_values = self.get_state_array()
+    nx.draw(graph, pos, cmap = plt.get_cmap('viridis'), node_color=color_values\
             , node_size=node_size, with_labels=with_labels, vmin = 0., vmax = 1.0)
 
   def get_pheromones_matrix(self):
-    # get the number of pheromones per node
-    pheromones = []
-    for i in sorted(self.nodes()):
-        if self.nodes[i]['state'] != State.wall:
-            neighbors = self[i]
-            accu_pheromone = 0
-            counter = 0
-            for neighbor_node, edge in neighbors.items():
-                if self.nodes[i]['state'] != State.wall:
-                    accu_pheromone += edge['pheromone']
-                    counter += 1
-                
-            pheromones.append(accu_pheromone/counter)
-        else:
-            pheromones.append(0)
-            
-    return np.array(pheromones).reshape((self.size, self.size))
+    """return the (size, size) matrix with the mean pheromone of the edges
+    of each node, 0 for the walls. The returned matrix is read only
+    """
+    if 'pheromones' not in self.matrices:
+      self.matrices['pheromones'] = self.__cache_matrix(self.get_node_pheromones())
+    return self.matrices['pheromones']
+
+  def get_node_pheromones(self, pheromone = None):
+    """return the mean pheromone of the edges of each node, 0 for the
+    walls, for the pheromones of the graph or the given pheromone array
+    """
+    pheromone = self.pheromone if pheromone is None else pheromone
+    # each edge adds its pheromone to both of its nodes
+    accu_pheromone = np.bincount(self.edge_nodes.ravel(), weights=np.repeat(pheromone, 2),
+                                 minlength=self.number_of_nodes())
+    degree = np.bincount(self.edge_nodes.ravel(), minlength=self.number_of_nodes())
+    return np.where(self.walls, 0., accu_pheromone / degree)
 
   def get_exploration_matrix(self):
-    # get the number of times that the ants visits per node.
-    exploration = [ self.nodes[i]['counter'] for i in sorted(self.nodes()) ]
-    exploration = np.array(exploration).reshape((self.size, self.size))
-    
-    return exploration
+    """return the (size, size) matrix with the number of times that the
+    ants visited each node. The returned matrix is read only
+    """
+    if 'exploration' not in self.matrices:
+      self.matrices['exploration'] = self.__cache_matrix(self.counter.copy())
+    return self.matrices['exploration']
+
+  def __cache_matrix(self, values):
+    matrix = values.reshape((self.size, self.size))
+    matrix.flags.writeable = False
+    return matrix
+
+
+class _NodeAttributes():
+  """dict like access to the attributes of a node stored in the arrays"""
+  def __init__(self, graph, node):
+    self.graph = graph
+    self.node = node
+
+  def __getitem__(self, key):
+    if key == 'state':
+      return self.graph.get_state(self.node)
+    if key == 'pos':
+      return tuple(self.graph.pos[self.node])
+    if key == 'counter':
+      return self.graph.counter[self.node]
+    raise KeyError(key)
+
+  def __setitem__(self, key, value):
+    if key == 'state':
+      self.graph.set_state(self.node, value)
+    elif key == 'counter':
+      self.graph.counter[self.node] = value
+      self.graph.mark_dirty('exploration')
+    else:
+      raise KeyError(key)
+
+
+class _NodeView():
+  def __init__(self, graph):
+    self.graph = graph
+
+  def __call__(self):
+    return list(self.graph)
+
+  def __getitem__(self, node):
+    return _NodeAttributes(self.graph, node)
+
+  def __iter__(self):
+    return iter(self.graph)
+
+  def __len__(self):
+    return len(self.graph)
+
+
+class _EdgeAttributes():
+  """dict like access to the attributes of an edge stored in the arrays"""
+  def __init__(self, graph, edge_id):
+    self.graph = graph
+    self.edge_id = edge_id
+
+  def __getitem__(self, key):
+    if key == 'pheromone':
+      return self.graph.pheromone[self.edge_id]
+    if key == 'distance':
+      return self.graph.distance[self.edge_id]
+    raise KeyError(key)
+
+  def __setitem__(self, key, value):
+    if key == 'pheromone':
+      self.graph.pheromone[self.edge_id] = value
+      self.graph.mark_dirty('pheromones')
+    elif key == 'distance':
+      self.graph.distance[self.edge_id] = value
+      self.graph.shortest_paths = {}
+    else:
+      raise KeyError(key)
+
+
+class _EdgeView():
+  def __init__(self, graph):
+    self.graph = graph
+
+  def __call__(self, data = False):
+    for edge_id, (node1, node2) in enumerate(self.graph.edge_nodes):
+      if data:
+        yield node1, node2, _EdgeAttributes(self.graph, edge_id)
+      else:
+        yield node1, node2
+
+  def __getitem__(self, edge):
+    return _EdgeAttributes(self.graph, self.graph.edge_id(*edge))
+
+  def __iter__(self):
+    return self()
+
+  def __len__(self):
+    return self.graph.number_of_edges()
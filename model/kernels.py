@@ -0,0 +1,185 @@
+import heapq
+import numpy as np
+
+# numba is optional, without it the kernels are plain python functions and
+# ACOPP falls back to the python backend
+try:
+  from numba import njit
+  NUMBA_AVAILABLE = True
+except ImportError:
+  NUMBA_AVAILABLE = False
+
+
+def construct_tour(neighbors, edge_index, edge_slots, pheromone, distance,
+                   counter, attractiveness, eta_beta, start_node, target_node,
+                   alpha, penalty, q_0, local_p, tau_0, steps_die, stamps,
+                   stamp, path, seed):
+  """
+  Tour construction of a single ant over the array representation of the
+  graph. It follows the same rules as ACOPP.update_state: the pheromone of
+  visited neighbors is penalized, with probability q_0 the best trial is
+  chosen and otherwise the wheel selection is used, and the local
+  evaporation is applied on each chosen edge.
+
+  The weights come from the cached attractiveness tau^alpha * eta^beta of
+  ACOPP, and the attractiveness of the edges that evaporate is refreshed.
+
+  The optional parameters are disabled with a negative value: q_0 < 0,
+  local_p < 0 and steps_die <= 0.
+
+  :param stamps: visit stamps of the nodes, the visited nodes are marked
+                 with stamp
+  :param path:   buffer for the nodes of the path, it is replaced by a
+                 bigger one when it is full
+  :param seed:   seed of the random numbers of the kernel
+  :return: (path, length, cost, arrived) where length is the number of
+           nodes of the path and arrived is False if the ant got stuck
+  """
+  np.random.seed(seed)
+
+  penalty_factor = (1 - penalty) ** alpha
+  weights = np.zeros(4)
+  position = start_node
+  path[0] = start_node
+  length = 1
+  stamps[start_node] = stamp
+  cost = 0.
+  step = 0
+
+  while True:
+    # weight of each feasible neighbor and the best trial
+    total = 0.
+    best_slot = -1
+    best_aux = -1.
+    for slot in range(4):
+      weights[slot] = 0.
+      neighbor = neighbors[position, slot]
+      if neighbor < 0:
+        continue
+      tau = pheromone[edge_index[position, slot]]
+      weights[slot] = attractiveness[position, slot]
+      if stamps[neighbor] == stamp:
+        tau = (1 - penalty) * tau
+        weights[slot] *= penalty_factor
+      eta = eta_beta[position, slot]
+      total += weights[slot]
+      if tau * eta > best_aux:
+        best_aux = tau * eta
+        best_slot = slot
+
+    # an ant without feasible neighbors is stuck
+    if best_slot < 0:
+      return path, length, cost, False
+
+    # with probability q_0 the best trial, also when all the weights
+    # underflow to 0 and the wheel has nothing to select
+    exploit = q_0 >= 0 and np.random.random() < q_0
+    if exploit or total <= 0:
+      choice = best_slot
+    else:
+      # wheel selection, the last option with weight absorbs the round off
+      wheel = np.random.random() * total
+      accumulated = 0.
+      choice = -1
+      for slot in range(4):
+        if weights[slot] > 0:
+          choice = slot
+          accumulated += weights[slot]
+          if accumulated > wheel:
+            break
+
+    new_position = neighbors[position, choice]
+    edge = edge_index[position, choice]
+
+    if local_p >= 0:
+      pheromone[edge] = (1 - local_p) * pheromone[edge] + local_p * tau_0
+      tau_alpha = pheromone[edge] ** alpha
+      for k in range(2):
+        node, node_slot = divmod(edge_slots[edge, k], 4)
+        attractiveness[node, node_slot] = tau_alpha * eta_beta[node, node_slot]
+
+    counter[position] += 1
+
+    if length == path.size:
+      bigger = np.empty(2 * path.size, dtype=path.dtype)
+      bigger[:length] = path[:length]
+      path = bigger
+    path[length] = new_position
+    length += 1
+    stamps[new_position] = stamp
+    cost += distance[edge]
+    position = new_position
+    step += 1
+
+    is_stuck = step == steps_die
+    if position == target_node:
+      counter[position] += 1
+      return path, length, cost, not is_stuck
+    if is_stuck:
+      return path, length, cost, False
+
+
+def shortest_path(neighbors, edge_index, distance, pos, start_node, target_node,
+                  min_distance):
+  """
+  Exact shortest path from start_node to target_node with A* over the
+  neighbor table. The heuristic is min_distance times the manhattan
+  distance to the target: every edge of the lattice costs at least
+  min_distance and changes the manhattan distance by one, so the
+  heuristic is consistent and the first time that the target is closed
+  its cost is optimal. With the default unit distances the search is a
+  breadth first search guided towards the target; the ties of the queue
+  are broken in favor of the nodes closer to the target.
+  :param min_distance: lower bound of the distance of the edges, 0 turns
+                       the search into Dijkstra
+  :return: (path, cost), the nodes of the path and its distance, an empty
+           path and inf if the target is not reachable
+  """
+  n_nodes = neighbors.shape[0]
+  cost = np.full(n_nodes, np.inf)
+  parent = np.full(n_nodes, -1, dtype=np.int64)
+  closed = np.zeros(n_nodes, dtype=np.bool_)
+  target_x = pos[target_node, 0]
+  target_y = pos[target_node, 1]
+
+  cost[start_node] = 0.
+  h = min_distance * (abs(pos[start_node, 0] - target_x) + abs(pos[start_node, 1] - target_y))
+  queue = [(h, h, np.int64(start_node))]
+  while len(queue) > 0:
+    _, _, node = heapq.heappop(queue)
+    if closed[node]:
+      continue
+    closed[node] = True
+    if node == target_node:
+      break
+
+    for slot in range(4):
+      neighbor = neighbors[node, slot]
+      if neighbor < 0 or closed[neighbor]:
+        continue
+      new_cost = cost[node] + distance[edge_index[node, slot]]
+      if new_cost < cost[neighbor]:
+        cost[neighbor] = new_cost
+        parent[neighbor] = node
+        h = min_distance * (abs(pos[neighbor, 0] - target_x) + abs(pos[neighbor, 1] - target_y))
+        heapq.heappush(queue, (new_cost + h, h, np.int64(neighbor)))
+
+  if not closed[target_node]:
+    return np.empty(0, dtype=np.int64), np.inf
+
+  length = 1
+  node = target_node
+  while node != start_node:
+    node = parent[node]
+    length += 1
+  path = np.empty(length, dtype=np.int64)
+  node = target_node
+  for i in range(length - 1, -1, -1):
+    path[i] = node
+    node = parent[node]
+  return path, cost[target_node]
+
+
+if NUMBA_AVAILABLE:
+  construct_tour = njit(cache=True)(construct_tour)
+  shortest_path = njit(cache=True)(shortest_path)
@@ -0,0 +1,104 @@
+from utils.paths import get_path_edges
+import numpy as np
+
+SCHEMES = ('linear', 'log', 'successful', 'length')
+CHUNK_SIZE = 2 ** 20
+
+def get_edge_counts(walker, num_rand_walks, scheme = 'linear', batch_size = 1024, max_steps = None):
+  """
+  Run num_rand_walks walks and accumulate how many times each edge was
+  visited, weighted according to the scheme:
+    'linear', 'log': every visit counts 1
+    'successful':    only the walks that got the target count
+    'length':        every visit of a walk counts 1 / length of the walk
+  The walkers that support it walk in batches, the rest one by one.
+  :param walker:         walker used to perform the random walks
+  :param num_rand_walks: number of random walks
+  :param scheme:         weighting of the visits
+  :param batch_size:     walks that advance at the same time in batched walks
+  :param max_steps:      maximum steps of a walk (optional)
+  :return: (edge_counts, node_counts)
+  """
+  if scheme not in SCHEMES:
+    raise ValueError("Unknown scheme: {}".format(scheme))
+
+  graph = walker.graph
+  edge_counts = np.zeros(graph.number_of_edges())
+  node_counts = np.zeros(graph.number_of_nodes(), dtype=np.int64)
+
+  if walker.batched and scheme in ('linear', 'log'):
+    # every visit counts the same, so the batched walks count them step
+    # by step without keeping the paths
+    for _ in walker.iter_batch(num_rand_walks, batch_size, max_steps, keep_paths = False,
+                               edge_counts = edge_counts, node_counts = node_counts):
+      pass
+    return edge_counts, node_counts
+
+  if walker.batched:
+    walks = walker.iter_batch(num_rand_walks, batch_size, max_steps)
+  else:
+    walks = walker.iter_walks(num_rand_walks, max_steps = max_steps)
+
+  # the edges of the walks are stored and counted at once in chunks of
+  # about CHUNK_SIZE visits
+  edges_list = []
+  weights_list = []
+  stored = 0
+  for nodes, distance, success in walks:
+    if scheme == 'successful' and not success:
+      continue
+
+    edges = get_path_edges(graph, nodes, jumps = True)
+    edges_list.append(edges)
+    weights_list.append(1 / max(len(nodes) - 1, 1) if scheme == 'length' else 1.)
+    stored += len(edges)
+    np.add.at(node_counts, nodes, 1)
+
+    if stored >= CHUNK_SIZE:
+      edge_counts += _count_edges(edges_list, weights_list, graph.number_of_edges())
+      edges_list, weights_list, stored = [], [], 0
+
+  if edges_list:
+    edge_counts += _count_edges(edges_list, weights_list, graph.number_of_edges())
+
+  return edge_counts, node_counts
+
+
+def _count_edges(edges_list, weights_list, n_edges):
+  lengths = [ len(edges) for edges in edges_list ]
+  return np.bincount(np.concatenate(edges_list),
+                     weights=np.repeat(weights_list, lengths),
+                     minlength=n_edges)
+
+
+def bootstrap_pheromones(graph, walker, num_rand_walks, scheme = 'linear',
+                         reward_tau = None, batch_size = 1024, max_steps = None):
+  """
+  Random walk bootstrapping. Initialize the pheromones of graph with the
+  edge visits of num_rand_walks random walks in one vectorized pass
+
+    tau = tau_0 + reward_tau * f(counts)
+
+  where f is the identity, or log(1 + counts) for the 'log' scheme. The
+  node counters of the graph are increased with the visits of the walks.
+  :param graph:          graph environment, the one of the walker
+  :param walker:         walker used to perform the random walks
+  :param num_rand_walks: number of random walks
+  :param scheme:         'linear', 'log', 'successful' or 'length'
+  :param reward_tau:     pheromone per visit (walker.reward_tau by default)
+  :param batch_size:     walks that advance at the same time in batched walks
+  :param max_steps:      maximum steps of a walk (optional)
+  :return: the graph with the new pheromones, ready for ACOPP
+  """
+  reward_tau = walker.reward_tau if reward_tau is None else reward_tau
+
+  edge_counts, node_counts = get_edge_counts(walker, num_rand_walks, scheme,
+                                             batch_size, max_steps)
+  if scheme == 'log':
+    edge_counts = np.log1p(edge_counts)
+
+  graph.pheromone[:] = graph.tau_0 + reward_tau * edge_counts
+  graph.counter += node_counts
+  graph.mark_dirty()
+
+  return graph
@@ -1,59 +1,67 @@
 from random_walk.walker import Walker
-from utils.measures import get_proximity, normalize_array, get_distance
+from utils.measures import normalize_array, normalize_rows, get_distance
+from model.graph_env import DOWN, RIGHT
+from utils.sampling import roulette_wheel
 import numpy as np
 
 class ProximityWalker(Walker):
+  batched = True
+
   def __init__(self, graph, q_0 = None, reward_tau = 0.0001,
                proximity_mode = 'proximity_1', distance_type = 'euclidean', 
-               normalization = None):
+               normalization = None, rng = None):
     
     self.proximity_mode = proximity_mode
     self.distance_type = distance_type
     self.normalization = normalization
-    super().__init__(graph, q_0, reward_tau)
+    super().__init__(graph, q_0, reward_tau, rng)
 
 
   def update_step(self):
-    neighbors = self.graph[self.current_position]
-
-    weights = []
-    neighbors_idx = []
-    for neighbor_node, edge in neighbors.items():
-        # get the weight per neighbor
-        weights.append(get_proximity(self.graph, 
-                                     self.current_position,
-                                     neighbor_node, 
-                                     self.target_node,
-                                     self.proximity_mode,
-                                     self.distance_type))
-        neighbors_idx.append(neighbor_node)
+    neighbors = self.graph.neighbors[self.current_position]
+    exists = neighbors >= 0
+    neighbors_idx = neighbors[exists]
+
+    # get the weight per neighbor
+    heuristic = self.graph.get_heuristic(self.target_node,
+                                         self.proximity_mode,
+                                         self.distance_type)
+    weights = heuristic[self.current_position][exists]
 
     # applied local normalization
     if self.normalization is not None:
       weights = normalize_array(weights, self.normalization)
       
 
-    if self.q_0 is not None and np.random.rand() < self.q_0:
+    if self.q_0 is not None and self.uniforms.next() < self.q_0:
       new_position = neighbors_idx[np.argmax(weights)]
   
     else:
-      acu_weight = sum(weights)
-      probabilities = np.array(weights)/acu_weight
-      #print("[INFO] probabilities: {}".format(probabilities))
-
       # choose an option following the wheel selection algorithm  
-      new_position = np.random.choice(neighbors_idx, p = probabilities)
+      new_position = neighbors_idx[roulette_wheel(weights, self.uniforms.next())]
       
-    self.current_path.append((self.current_position, new_position))
-    self.visited_nodes.append(new_position)
-    self.current_position = new_position
+    self.move(new_position)
+
+  def get_batch_weights(self, current_nodes, neighbors, exists):
+    heuristic = self.graph.get_heuristic(self.target_node,
+                                         self.proximity_mode,
+                                         self.distance_type)
+    weights = heuristic[current_nodes]
+
+    # applied local normalization
+    if self.normalization is not None:
+      weights = normalize_rows(weights, exists, self.normalization)
+
+    return np.where(exists, weights, 0.)
 
 
 class GreedyWalker(Walker):
-  def __init__(self, graph, q_0 = None, reward_tau = 0.0001, advantage = 3):
+  batched = True
+
+  def __init__(self, graph, q_0 = None, reward_tau = 0.0001, advantage = 3, rng = None):
 
     self.advantage = advantage
-    super().__init__(graph, q_0, reward_tau)
+    super().__init__(graph, q_0, reward_tau, rng)
 
   def get_greedy_favorites(self, location = ('bottom','right') ):
     
@@ -71,104 +79,211 @@ class GreedyWalker(Walker):
     return favorites_nodes
 
   def update_step(self):
-    neighbors = self.graph[self.current_position]
+    neighbors = self.graph.neighbors[self.current_position]
 
-    neighbors_idx = [n for n, edge in neighbors.items()]
+    neighbors_idx = neighbors[neighbors >= 0]
     favorites = self.get_greedy_favorites()
     weights = [ self.advantage if n in favorites else 1 for n in neighbors_idx ]
 
 
-    if self.q_0 is not None and np.random.rand() < self.q_0:
+    if self.q_0 is not None and self.uniforms.next() < self.q_0:
       new_position = neighbors_idx[np.argmax(weights)]
       # arg_max = np.argwhere(weights == np.amax(weights))
       # new_position = np.random.choice(arg_max.flatten(), 1)[0]
   
     else:
-      acu_weight = sum(weights)
-      probabilities = np.array(weights)/acu_weight
       # print("[INFO] curren_node: {} nodes: \t {}".format(self.current_position, neighbors_idx))
-      # print("[INFO] probabilities: \t {}".format(probabilities))
 
       # choose an option following the wheel selection algorithm 
-      new_position = np.random.choice(neighbors_idx, p = probabilities)
+      new_position = neighbors_idx[roulette_wheel(weights, self.uniforms.next())]
       
-    self.current_path.append((self.current_position, new_position))
-    self.visited_nodes.append(new_position)
-    self.current_position = new_position
+    self.move(new_position)
 
+  def get_batch_weights(self, current_nodes, neighbors, exists):
+    # the favorites are the bottom and right neighbors
+    favorites = np.zeros(4, dtype=bool)
+    favorites[[DOWN, RIGHT]] = True
 
-class LevyFlightProximityWalker(ProximityWalker):
-  def __init__(self, graph, q_0 = None,
-               omega = 1, 
-               reward_tau = 0.0001,
-               proximity_mode = 'proximity_1', 
-               distance_type = 'euclidean', 
-               normalization = None):
-    # omega clustering exponent
-
-    self.omega = omega # [1-3]
-
-    super().__init__(graph, q_0, reward_tau, 
-                     proximity_mode, 
-                     distance_type, 
-                     normalization)
+    return np.where(exists, np.where(favorites, float(self.advantage), 1.), 0.)
 
-  def update_step(self):
 
-    # get the neighbors of the current node
-    neighbors = self.graph[self.current_position]
-    neighbors_idx = [n for n, edge in neighbors.items()]
+class LevyFlight():
+  """
+  Long range jumps of the Levy flight walkers. In each step a long range
+  node is chosen among the nodes that are not the start, the target, the
+  current node nor its neighbors, and the walker jumps to it with
+  probability d^-omega; otherwise it takes the step of its base walker.
 
-    # build a list with the possible long range connections
-    # here we do not included the neighbors nor the start node
-    # or target node
-    excluding_idx = neighbors_idx + [self.current_position]
-    pos_connections = [ n for n in np.arange(self.start_node + 1, self.target_node) if n not in excluding_idx]
+  long_range = 'uniform' draws the candidate uniformly by rejection, and
+  long_range = 'power_law' draws the jump directly from the d^-omega law,
+  which gives the same distribution of moves without the rejected jumps.
+  """
+  batched = False
+  # rejected draws after which the candidates are listed, e.g. when most
+  # of the nodes are walls
+  max_rejections = 100
 
-    long_range_node = np.random.choice(pos_connections)
+  def init_long_range(self, omega, long_range):
+    if long_range not in ('uniform', 'power_law'):
+      raise ValueError("Unknown long_range: {}".format(long_range))
 
-    dist_current2long_range = get_distance(self.graph.nodes[long_range_node]['pos'],
-                                           self.graph.nodes[self.current_position]['pos'],
+    # omega clustering exponent
+    self.omega = omega # [1-3]
+    self.long_range = long_range
+
+    # probability of a jump from each node and the d^-omega law over the
+    # (row, col) offsets, both are built on demand for 'power_law'. The
+    # jump probabilities belong to the walls and the query of jump_key
+    self.jump_mass = None
+    self.jump_key = None
+    self.offsets = None
+    self.offsets_cumulative = None
+
+  def is_long_range_candidate(self, node):
+    return (self.start_node < node < self.target_node
+            and not self.graph.walls[node]
+            and node != self.current_position
+            and node not in self.graph.neighbors[self.current_position])
+
+  def get_long_range_candidates(self):
+    candidates = np.arange(self.start_node + 1, self.target_node)
+    excluding_idx = np.append(self.graph.neighbors[self.current_position], self.current_position)
+    return candidates[~np.isin(candidates, excluding_idx) & ~self.graph.walls[candidates]]
+
+  def get_jump_probability(self, node):
+    # the coordinates go in the first axis, so node can be an array
+    dist_current2long_range = get_distance(self.graph.pos[node].T,
+                                           self.graph.pos[self.current_position],
                                            'euclidean')
+    return dist_current2long_range ** (- self.omega)
+
+  def get_offsets_law(self):
+    """return the (2 * size - 1, 2 * size - 1) grid of d^-omega over the
+    (row, col) offsets of the lattice, 0 for the null offset
+    """
+    size = self.size
+    d_row, d_col = np.mgrid[1 - size:size, 1 - size:size]
+    law = np.zeros(d_row.shape)
+    far = (d_row != 0) | (d_col != 0)
+    law[far] = np.hypot(d_row[far], d_col[far]) ** (- self.omega)
+    return law
+
+  def get_jump_mass(self):
+    """
+    Probability of a jump from each node, the mean of d^-omega over its
+    candidates. The sums of the law over the free nodes between the start
+    and the target are the correlation of their mask with the law of the
+    offsets, computed for all the nodes at once with FFTs in
+    O(N log N); each node then takes out itself and its neighbors, at
+    distance 1.
+    """
+    size = self.size
+    graph = self.graph
+    nodes = np.arange(graph.number_of_nodes())
+    allowed = (self.start_node < nodes) & (nodes < self.target_node) & ~graph.walls
+
+    shape = (3 * size - 2, 3 * size - 2)
+    spectrum = np.fft.rfft2(allowed.reshape((size, size)), shape) * \
+               np.fft.rfft2(self.get_offsets_law(), shape)
+    mass = np.fft.irfft2(spectrum, shape)[size - 1:2 * size - 1, size - 1:2 * size - 1].ravel()
+
+    near = (graph.neighbors >= 0) & allowed[graph.neighbors]
+    n_near = near.sum(axis=1)
+    n_candidates = allowed.sum() - allowed - n_near
+    mass = np.maximum(mass - n_near, 0.)
+    return np.where(n_candidates > 0, mass / np.maximum(n_candidates, 1), 0.)
+
+  def sample_uniform_jump(self):
+    # with a few candidates the rejection could not end, so they are listed
+    long_range_node = None
+    if self.target_node - self.start_node > 6:
+      for _ in range(self.max_rejections):
+        node = self.rng.integers(self.start_node + 1, self.target_node)
+        if self.is_long_range_candidate(node):
+          long_range_node = node
+          break
+    if long_range_node is None:
+      candidates = self.get_long_range_candidates()
+      if candidates.size == 0:
+        return None
+      long_range_node = self.rng.choice(candidates)
+
+    if self.uniforms.next() < self.get_jump_probability(long_range_node):
+      return long_range_node
+    return None
+
+  def sample_power_law_jump(self):
+    size = self.size
+    current = self.current_position
+
+    # the probability of a jump from the current node is the mean of
+    # d^-omega over its candidates, the candidates change with the walls
+    # and the query
+    jump_key = (self.graph.walls_version, self.start_node, self.target_node)
+    if self.jump_key != jump_key:
+      self.jump_mass = self.get_jump_mass()
+      self.jump_key = jump_key
+
+    if self.uniforms.next() >= self.jump_mass[current]:
+      return None
+
+    if self.offsets is None:
+      d_row, d_col = np.mgrid[1 - size:size, 1 - size:size]
+      self.offsets = np.stack([d_row.ravel(), d_col.ravel()], axis=1)
+      self.offsets_cumulative = np.cumsum(self.get_offsets_law().ravel())
+
+    # draw offsets from the d^-omega law until they land on a candidate,
+    # with few candidates they are drawn from the same law over the list
+    row, col = divmod(current, size)
+    for _ in range(self.max_rejections):
+      wheel = self.uniforms.next() * self.offsets_cumulative[-1]
+      d_row, d_col = self.offsets[np.searchsorted(self.offsets_cumulative, wheel, side='right')]
+      if 0 <= row + d_row < size and 0 <= col + d_col < size:
+        long_range_node = (row + d_row) * size + col + d_col
+        if self.is_long_range_candidate(long_range_node):
+          return long_range_node
+
+    candidates = self.get_long_range_candidates()
+    law = self.get_jump_probability(candidates)
+    return candidates[roulette_wheel(law, self.uniforms.next())]
 
-    if np.random.rand() < dist_current2long_range ** (- self.omega):
-      new_position = long_range_node
-      self.current_path.append((self.current_position, new_position))
-      self.visited_nodes.append(new_position)
-      self.current_position = new_position
+  def update_step(self):
+    if self.long_range == 'power_law':
+      long_range_node = self.sample_power_law_jump()
     else:
-      super().update_step()
+      long_range_node = self.sample_uniform_jump()
 
-class LevyFlightGreedyWalker(GreedyWalker):
-  def __init__(self, graph, q_0 = None, reward_tau = 0.0001, omega = 2, advantage = 3):
-    # omega clustering exponent
-
-    self.omega = omega # [1-3]
+    if long_range_node is not None:
+      self.move(long_range_node)
+    else:
+      super().update_step()
 
-    super().__init__(graph, q_0, reward_tau, advantage)
+  def get_batch_weights(self, current_nodes, neighbors, exists):
+    # the long range jumps are not part of the batched walks
+    raise NotImplementedError("{} does not support batched walks".format(type(self).__name__))
 
-  def update_step(self):
 
-    # get the neighbors of the current node
-    neighbors = self.graph[self.current_position]
-    neighbors_idx = [n for n, edge in neighbors.items()]
+class LevyFlightProximityWalker(LevyFlight, ProximityWalker):
+  def __init__(self, graph, q_0 = None,
+               omega = 1, 
+               reward_tau = 0.0001,
+               proximity_mode = 'proximity_1', 
+               distance_type = 'euclidean', 
+               normalization = None,
+               rng = None,
+               long_range = 'uniform'):
 
-    # build a list with the possible long range connections
-    # here we do not included the neighbors nor the start node
-    # or target node
-    excluding_idx = neighbors_idx + [self.current_position]
-    pos_connections = [ n for n in np.arange(self.start_node + 1, self.target_node) if n not in excluding_idx]
+    super().__init__(graph, q_0, reward_tau, 
+                     proximity_mode, 
+                     distance_type, 
+                     normalization,
+                     rng)
+    self.init_long_range(omega, long_range)
 
-    long_range_node = np.random.choice(pos_connections)
 
-    dist_current2long_range = get_distance(self.graph.nodes[long_range_node]['pos'],
-                                           self.graph.nodes[self.current_position]['pos'],
-                                           'euclidean')
+class LevyFlightGreedyWalker(LevyFlight, GreedyWalker):
+  def __init__(self, graph, q_0 = None, reward_tau = 0.0001, omega = 2, advantage = 3, rng = None,
+               long_range = 'uniform'):
 
-    if np.random.rand() < dist_current2long_range ** (- self.omega):
-      new_position = long_range_node
-      self.current_path.append((self.current_position, new_position))
-      self.visited_nodes.append(new_position)
-      self.current_position = new_position
-    else:
-      super().update_step()
\ No newline at end of file
+    super().__init__(graph, q_0, reward_tau, advantage, rng)
+    self.init_long_range(omega, long_range)
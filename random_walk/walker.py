@@ -1,67 +1,330 @@
 from utils.measures import get_distance
+from collections import namedtuple
+from statistics import NormalDist
+import time
+from utils.paths import PathBuffer
+from utils.sampling import UniformStream, get_rng, roulette_wheel
+import numpy as np
+
+# result of a walk of Walker.stream_walks, total_steps are the steps of all
+# the walks streamed so far
+WalkResult = namedtuple('WalkResult', ['index', 'length', 'distance', 'success', 'total_steps'])
 
 class Walker():
-  def __init__(self, graph, q_0 = None, reward_tau = 0.0001):
+  # if the walker supports batched walks (iter_batch)
+  batched = False
+
+  def __init__(self, graph, q_0 = None, reward_tau = 0.0001, rng = None):
     
-  
+    # rng: numpy.random.Generator or seed of the random decisions
+    self.rng = get_rng(rng)
+    self.uniforms = UniformStream(self.rng)
     self.graph = graph
     self.q_0 = q_0
     self.size = graph.size
     self.start_node = 0
     self.target_node = graph.size * graph.size - 1
     self.reward_tau = reward_tau
+    self.path = PathBuffer(graph.number_of_nodes())
     self.reset_walk()
 
   def reset_walk(self):
-    self.current_path = []
     self.current_position = self.start_node
-    self.visited_nodes = [self.start_node]
+    self.path.reset(self.start_node)
 
-  def get_distance_path(self):
-    total_distance = 0
-    for node1, node2 in self.current_path:
-      pos1 = self.graph.nodes[node1]['pos']
-      pos2 = self.graph.nodes[node2]['pos']
-      total_distance += get_distance(pos1, pos2, 'euclidean')
+  @property
+  def visited_nodes(self):
+    return self.path.nodes
 
-    return total_distance
+  @property
+  def current_path(self):
+    return self.path.edges()
+
+  def move(self, new_position):
+    self.path.append(new_position)
+    self.current_position = new_position
+
+  def get_distance_path(self):
+    # the coordinates go in the first axis, so get_distance can unpack them
+    pos = self.graph.pos[self.path.nodes].T.astype(float)
+    return get_distance(pos[:, :-1], pos[:, 1:], 'euclidean').sum()
 
   def end_route(self):
     return self.current_position == self.target_node
 
-  def walk(self, num_rand_walks, verbose = True):
-    # Create
-    distances_list = []
-
+  def iter_walks(self, num_rand_walks, verbose = False, max_steps = None,
+                 step_budget = None):
+    """
+    Perform num_rand_walks walks one after the other, yielding
+    (nodes, distance, success) of each walk when it ends, success is
+    False when the walk runs out of max_steps. The walks stop when the
+    steps of all of them reach step_budget, the walk in course ends there
+    as unsuccessful
+    """
+    total_steps = 0
     for i in range(int(num_rand_walks)):
       
       self.reset_walk()
 
       is_complete = False
+      steps = 0
 
       while not is_complete:
         self.update_step()
+        steps += 1
+        total_steps += 1
 
-        is_complete = self.end_route()
+        is_complete = self.end_route() or steps == max_steps or total_steps == step_budget
 
       if verbose:
         print("[INFO] n_rw: [{}/{}] len_path: {}".format(i+1, 
                                                  int(num_rand_walks),
-                                                 len(self.current_path) ))
-      distances_list.append(self.get_distance_path())
+                                                 len(self.path) ))
+      yield self.path.nodes.copy(), self.get_distance_path(), self.end_route()
+      if total_steps == step_budget:
+        return
+
+  def stream_walks(self, num_rand_walks, max_steps = None, time_budget = None,
+                   step_budget = None, ci_tol = None, confidence = 0.95,
+                   min_walks = 10, batch_size = 1024):
+    """
+    Streaming random walks. Yield a WalkResult for each walk in the order
+    the walks started, so stopping early does not favor the short walks
+    of a batch. The stream stops after num_rand_walks walks, or earlier
+    when
+      - time_budget seconds have passed, checked when a walk ends
+      - step_budget steps were taken, counting the steps of the walks in
+        course on every step; those walks end there as unsuccessful
+      - the confidence interval of the mean distance of the successful
+        walks has a half width below ci_tol, after min_walks of them
+    :param confidence: confidence level of the interval, e.g. 0.95
+    :param batch_size: walks that advance at the same time if the walker
+                       supports batched walks
+    """
+    # only the steps of each walk are needed, the batched walks do not
+    # keep the paths, neither the ones that wait for an earlier walk
+    if self.batched:
+      walks = self.iter_batch(num_rand_walks, batch_size, max_steps,
+                              step_budget = step_budget, ordered = True, keep_paths = False)
+    else:
+      walks = ((len(nodes) - 1, distance, success) for nodes, distance, success
+               in self.iter_walks(num_rand_walks, max_steps = max_steps,
+                                  step_budget = step_budget))
+
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    start_time = time.perf_counter()
+    total_steps = 0
+
+    # running mean and variance of the distances of the successful walks
+    n_success = 0
+    mean = 0.
+    m2 = 0.
+
+    for index, (steps, distance, success) in enumerate(walks):
+      total_steps += steps
+      yield WalkResult(index, steps, distance, success, total_steps)
+
+      if success:
+        n_success += 1
+        delta = distance - mean
+        mean += delta / n_success
+        m2 += delta * (distance - mean)
+
+      if time_budget is not None and time.perf_counter() - start_time >= time_budget:
+        break
+      if ci_tol is not None and n_success >= max(min_walks, 2):
+        half_width = z * np.sqrt(m2 / (n_success - 1) / n_success)
+        if half_width <= ci_tol:
+          break
+
+    walks.close()
+
+  def walk(self, num_rand_walks, verbose = True, recorder = None):
+    """
+    Perform num_rand_walks walks and return the distance of each one.
+    :param recorder: FrameRecorder that takes a snapshot after each walk of
+                     the visits of the walks so far to each node (optional)
+    """
+    distances_list = []
+    visits = np.zeros(self.graph.number_of_nodes(), dtype=np.int64)
+    for i, (nodes, distance, _) in enumerate(self.iter_walks(num_rand_walks, verbose)):
+      distances_list.append(distance)
+      if recorder is not None:
+        visits += np.bincount(nodes, minlength=visits.size)
+        recorder.record(self.graph, i, counter=visits)
 
     return distances_list
 
+  def get_batch_weights(self, current_nodes, neighbors, exists):
+    """return the (n, 4) weights of the neighbor slots of the current
+    nodes of a batch of walks, the walkers that support batched walks
+    define it
+    """
+    raise NotImplementedError("{} does not support batched walks".format(type(self).__name__))
+
+  def iter_batch(self, num_rand_walks, batch_size = 1024, max_steps = None,
+                 step_budget = None, ordered = False, keep_paths = True,
+                 edge_counts = None, node_counts = None):
+    """
+    Batched random walks. Up to batch_size walks advance at the same time
+    as arrays, and the slot of a walk is reused by the next walk as soon
+    as it ends. Yield (nodes, distance, success) of each walk when it ends,
+    success is False when the walk runs out of max_steps or gets stuck.
+    :param step_budget: the walks stop when the steps of all of them, the
+                        walks in course included, reach step_budget; the
+                        walks in course end there as unsuccessful
+    :param ordered:     yield the walks in the order they started instead
+                        of the order they end, the walks that end before an
+                        earlier one wait in a buffer
+    :param keep_paths:  if False the nodes of the walks are not kept, and
+                        the number of steps of each walk is yielded in
+                        their place
+    :param edge_counts: array where the visits to each edge are added step
+                        by step (optional)
+    :param node_counts: array where the visits to each node are added step
+                        by step, the start node included (optional)
+    """
+    graph = self.graph
+    n_walks = int(num_rand_walks)
+    batch = min(batch_size, n_walks)
+    slots = np.arange(batch)
+    pos = graph.pos.astype(float)
+
+    positions = np.full(batch, self.start_node)
+    lengths = np.ones(batch, dtype=int)
+    distances = np.zeros(batch)
+    active = np.ones(batch, dtype=bool)
+    if keep_paths:
+      paths = np.empty((batch, 4 * self.size), dtype=np.int32)
+      paths[:, 0] = self.start_node
+    if node_counts is not None:
+      node_counts[self.start_node] += batch
+    started = batch
+    total_steps = 0
+    # start order of the walk of each slot, and the ended walks that wait
+    # for the earlier ones when ordered
+    walk_ids = np.arange(batch)
+    waiting = {}
+    next_id = 0
+
+    def get_walk(slot):
+      # nodes of the walk of slot, or its steps without paths
+      if keep_paths:
+        return paths[slot, :lengths[slot]].copy()
+      return int(lengths[slot] - 1)
+
+    while active.any():
+      moving = slots[active]
+      if step_budget is not None:
+        # the last step of the budget only advances some of the walks
+        moving = moving[:step_budget - total_steps]
+      current = positions[moving]
+      neighbors = graph.neighbors[current]
+      exists = neighbors >= 0
+
+      weights = self.get_batch_weights(current, neighbors, exists)
+      choice = roulette_wheel(weights, self.rng.random(moving.size))
+      if self.q_0 is not None:
+        exploit = self.rng.random(moving.size) < self.q_0
+        choice[exploit] = np.argmax(np.where(exists, weights, -np.inf)[exploit], axis=1)
+
+      # a walk without options is stuck where it is, it ends without a step
+      is_stuck = ~(weights > 0).any(axis=1)
+      new_positions = np.where(is_stuck, current, neighbors[np.arange(moving.size), choice])
+      stepping = moving[~is_stuck]
+
+      if keep_paths:
+        if lengths.max() >= paths.shape[1]:
+          paths = np.concatenate([paths, np.empty_like(paths)], axis=1)
+        paths[stepping, lengths[stepping]] = new_positions[~is_stuck]
+      if edge_counts is not None:
+        edges = graph.edge_index[current[~is_stuck], choice[~is_stuck]]
+        edge_counts += np.bincount(edges, minlength=edge_counts.size)
+      if node_counts is not None:
+        node_counts += np.bincount(new_positions[~is_stuck], minlength=node_counts.size)
+      lengths[stepping] += 1
+      distances[stepping] += get_distance(pos[current[~is_stuck]].T,
+                                          pos[new_positions[~is_stuck]].T, 'euclidean')
+      positions[moving] = new_positions
+      total_steps += stepping.size
+
+      success = new_positions == self.target_node
+      ended = success | is_stuck
+      if max_steps is not None:
+        ended |= lengths[moving] - 1 >= max_steps
+      out_of_budget = step_budget is not None and total_steps >= step_budget
+
+      ended_walks = []
+      for slot, is_success in zip(moving[ended], success[ended]):
+        ended_walks.append((walk_ids[slot], get_walk(slot), distances[slot], is_success))
+
+        if started < n_walks and not out_of_budget:
+          positions[slot] = self.start_node
+          lengths[slot] = 1
+          distances[slot] = 0.
+          walk_ids[slot] = started
+          started += 1
+          if node_counts is not None:
+            node_counts[self.start_node] += 1
+        else:
+          active[slot] = False
+
+      if out_of_budget:
+        for slot in slots[active]:
+          ended_walks.append((walk_ids[slot], get_walk(slot), distances[slot], False))
+        active[:] = False
+
+      if not ordered:
+        for _, nodes, distance, is_success in ended_walks:
+          yield nodes, distance, is_success
+        continue
+
+      waiting.update((walk_id, walk) for walk_id, *walk in ended_walks)
+      while next_id in waiting:
+        yield tuple(waiting.pop(next_id))
+        next_id += 1
+
+  def walk_batch(self, num_rand_walks, batch_size = 1024, max_steps = None, return_counts = False):
+    """
+    Perform num_rand_walks walks with iter_batch and return a dict with
+    the path length, the distance and the success of each walk. With
+    return_counts, it also has the number of times each edge was visited.
+    """
+    lengths = []
+    distances = []
+    success = []
+    # the visits are counted step by step, without keeping the paths
+    counts = np.zeros(self.graph.number_of_edges()) if return_counts else None
+
+    for steps, distance, is_success in self.iter_batch(num_rand_walks, batch_size, max_steps,
+                                                       keep_paths = False, edge_counts = counts):
+      lengths.append(steps)
+      distances.append(distance)
+      success.append(is_success)
+
+    result = {
+        "lengths" : np.array(lengths),
+        "distances" : np.array(distances),
+        "success" : np.array(success, dtype=bool)
+    }
+    if return_counts:
+      result["counts"] = counts
+
+    return result
+
   def reinforce_rw(self):
     # Give a small reward to the edges of the current randown walk
-    
-    for node1, node2 in self.current_path:
+    nodes = self.path.nodes
+    node1, node2 = nodes[:-1], nodes[1:]
 
-      node2_options = [node1+1, node1-1, node1 - self.graph.size, node1 + self.graph.size]
+    # the long range jumps are not edges of the graph
+    slots = self.graph.neighbors[node1] == node2[:, None]
+    is_edge = slots.any(axis=1)
+    edges = self.graph.edge_index[node1, np.argmax(slots, axis=1)][is_edge]
 
-      if node2 in node2_options:
-        self.graph[node1][node2]['pheromone'] += self.reward_tau
-        self.graph.nodes[node1]['counter'] += 1
+    np.add.at(self.graph.pheromone, edges, self.reward_tau)
+    np.add.at(self.graph.counter, node1[is_edge], 1)
 
-    last_node = self.current_path[-1][1]
-    self.graph.nodes[last_node]['counter'] += 1
\ No newline at end of file
+    last_node = nodes[-1]
+    self.graph.counter[last_node] += 1
+    self.graph.mark_dirty()
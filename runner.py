@@ -0,0 +1,259 @@
+# script for running the experiments of test_aco.py and test_rw.py in parallel
+import os
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from model.graph_env import PPGraph
+from model.aco import ACOPP
+import random_walk.rw_models as rw
+from utils.results import ResultsStore
+
+SEED = 10000
+
+EXPERIMENT_FILES = {
+    "aco": "stuff/experiments/params_experiments.xlsx",
+    "rw": "stuff/experiments/rw_experiments_1.xlsx",
+}
+
+
+def optional(value):
+    """return None for the empty cells of the experiment file"""
+    return None if pd.isna(value) else value
+
+
+def build_graph(row, tau_0, rng = None):
+    """Create the graph environment of a row of the experiment file, with
+    a random map when the row has a maze method
+    """
+    method = optional(row.get("maze"))
+    if method is None:
+        return PPGraph(size = row["size"], tau_0 = tau_0)
+
+    density = optional(row.get("density"))
+    return PPGraph.from_maze(row["size"], tau_0, method, rng = rng,
+                             **({} if density is None else {"density": density}))
+
+
+def build_optimizer(row, graph, rng = None):
+    """Create the ACOPP optimizer of a row of the experiment file"""
+    return ACOPP(graph,
+                 row["ants"],
+                 row["alpha"],
+                 row["beta"],
+                 row["p"],
+                 row["penalty"],
+                 optional(row["local_p"]),
+                 optional(row["intensity"]),
+                 row["q_0"],
+                 row["proximity"],
+                 postprocess = optional(row.get("postprocess")),
+                 rng = rng)
+
+
+def build_walker(row, graph, rng = None):
+    """Create the walker of a row of the experiment file"""
+    if row["type"] == "greedy":
+        return rw.GreedyWalker(graph,
+                               q_0 = row["q_0"],
+                               advantage = row["advantage"],
+                               rng = rng)
+    elif row["type"] == "levy_greedy":
+        return rw.LevyFlightGreedyWalker(graph,
+                                         q_0 = row["q_0"],
+                                         omega = row["omega"],
+                                         advantage = row["advantage"],
+                                         rng = rng)
+    elif row["type"] == "proximity":
+        return rw.ProximityWalker(graph,
+                                  q_0 = row["q_0"],
+                                  proximity_mode = row["proximity"],
+                                  rng = rng)
+    elif row["type"] == "levy_proximity":
+        return rw.LevyFlightProximityWalker(graph,
+                                            q_0 = row["q_0"],
+                                            omega = row["omega"],
+                                            proximity_mode = row["proximity"],
+                                            rng = rng)
+
+    raise ValueError(f'The type {row["type"]} is not defined')
+
+
+def run_aco(row, total_iter, iter_show, rng, checkpoint = None):
+    graph = build_graph(row, row['tau_0'], rng)
+    optimizer = build_optimizer(row, graph, rng)
+    return optimizer.fit(total_iter, iter_show = iter_show, checkpoint = checkpoint)
+
+
+def run_rw(row, total_iter, iter_show, rng):
+    graph = build_graph(row, 0.1, rng)
+    walker = build_walker(row, graph, rng)
+    distances_list = walker.walk(row['n_rw'], verbose = False)
+
+    return {
+        "distances" : np.array(distances_list),
+        "mean"  : np.mean(distances_list),
+        "std"  : np.std(distances_list),
+        "sem"  : np.std(distances_list, ddof=1) / np.sqrt(np.size(distances_list))
+    }
+
+
+RUNS = {"aco": run_aco, "rw": run_rw}
+
+
+def get_jobs(kind, params, executions, saving_dir, seed):
+    """list of independent (row, execution) jobs, each one with its own
+    SeedSequence so the results do not depend on the scheduling
+    """
+    jobs = []
+    for index, row in params.iterrows():
+        for execution in range(executions):
+            checkpoint = "checkpoint_exp_{}_exc_{}.npz".format(
+                str(index).zfill(2),
+                str(execution).zfill(2))
+
+            jobs.append({
+                "kind": kind,
+                "index": index,
+                "execution": execution,
+                "row": row.to_dict(),
+                "seed": np.random.SeedSequence(seed, spawn_key=(int(index), execution)),
+                "checkpoint": os.path.join(saving_dir, checkpoint),
+            })
+    return jobs
+
+
+def run_job(job, total_iter, iter_show):
+    """execute a single job in a worker process and return its history.
+    The aco jobs keep a checkpoint, so a killed job is resumed from its
+    last checkpoint
+    """
+    rng = np.random.default_rng(job["seed"])
+
+    logging.info("Running sub experiment: {} execution: {} \n {}".format(
+        job["index"], job["execution"], job["row"]))
+
+    if job["kind"] == "aco":
+        history = run_aco(job["row"], total_iter, iter_show, rng, job["checkpoint"])
+    else:
+        history = RUNS[job["kind"]](job["row"], total_iter, iter_show, rng)
+
+    return history
+
+
+def init_worker(log_file):
+    logging.basicConfig(
+        filename=log_file,
+        filemode='a',
+        format='%(asctime)s | %(process)d | line: %(lineno)d | %(levelname)s: %(message)s', level=logging.NOTSET)
+
+
+def run_experiment(kind, exp_name, exp_file, executions, total_iter, iter_show,
+                   workers = None, exp_start = None, exp_end = None,
+                   seed = SEED, log_file = None):
+    """
+    Run all the (row, execution) jobs of an experiment in a process pool.
+    The results are appended to the ResultsStore of the experiment, and the
+    jobs already stored are skipped, so an interrupted experiment is resumed
+    by running it again.
+    """
+    params = pd.read_excel(exp_file, sheet_name=exp_name)
+
+    saving_dir = "stuff/results/aco_pp/histories_{}/".format(exp_name)
+    if not os.path.exists(saving_dir):
+        os.makedirs(saving_dir)
+
+    logging.info("Running experiment: {}".format(exp_name))
+    logging.info("\n {}".format(params.head()))
+
+    if exp_start is not None and exp_end is not None:
+        params = params.loc[(params.index >= exp_start) & (params.index < exp_end)]
+
+    # the runs are written in chunks, at the latest flush_interval seconds
+    # after a job ends, and the buffered ones when the sweep stops
+    store = ResultsStore(saving_dir)
+    jobs = get_jobs(kind, params, executions, saving_dir, seed)
+    pending = [ job for job in jobs if (job["index"], job["execution"]) not in store ]
+    logging.info("Jobs: {} pending: {}".format(len(jobs), len(pending)))
+
+    stored = []
+    with store, ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                    initargs=(log_file,)) as pool:
+        futures = { pool.submit(run_job, job, total_iter, iter_show): job for job in pending }
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                job = futures[future]
+                try:
+                    history = future.result()
+                except Exception:
+                    # a failed job does not stop the others, running the
+                    # experiment again retries it
+                    logging.exception("[{}/{}] failed: {} {}".format(done, len(pending), job["index"], job["execution"]))
+                    continue
+
+                store.append(job["index"], job["execution"],
+                             dict(job["row"], total_iter=total_iter), history)
+                stored.append(job)
+                logging.info("[{}/{}] stored: {} {}".format(done, len(pending), job["index"], job["execution"]))
+        except BaseException:
+            # the queued jobs are not run when the experiment is interrupted
+            for future in futures:
+                future.cancel()
+            raise
+
+    # the small chunks of the time based flushes are merged
+    store.compact()
+
+    # the checkpoints of the stored jobs are not needed anymore
+    for job in stored:
+        if os.path.exists(job["checkpoint"]):
+            os.remove(job["checkpoint"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the experiments in parallel')
+    parser.add_argument('kind', choices=['aco', 'rw'],
+                        help='aco for the experiments of test_aco.py, rw for the ones of test_rw.py')
+    parser.add_argument('--exp_name', default=None, type=str,
+                        help='the name of the experiment that you want to execute', required=True)
+    parser.add_argument('--exp_file', default=None, type=str,
+                        help='the file where is stored the specifications of your experiment')
+    parser.add_argument('--exp_start', default=None, type=int,
+                        help='the id of the experiment to start')
+    parser.add_argument('--exp_end', default=None, type=int,
+                        help='the id of the experiment to end')
+    parser.add_argument('--executions', default=None, type=int,
+                        help='executions per experiment (30 for aco and 1 for rw by default)')
+    parser.add_argument('--total_iter', default=100, type=int,
+                        help='iterations of the optimizer')
+    parser.add_argument('--iter_show', default=25, type=int,
+                        help='iterations between logs of the optimizer')
+    parser.add_argument('--workers', default=None, type=int,
+                        help='number of processes (all the cpus by default)')
+    parser.add_argument('--seed', default=SEED, type=int,
+                        help='root seed of the experiment')
+    args = parser.parse_args()
+
+    date = datetime.now().strftime("%Y_%m_%d-%I:%M:%S_%p")
+    log_file = f"stuff/logs/{args.exp_name}_{date}.log"
+    init_worker(log_file)
+
+    executions = args.executions
+    if executions is None:
+        executions = 30 if args.kind == "aco" else 1
+
+    run_experiment(args.kind,
+                   args.exp_name,
+                   args.exp_file or EXPERIMENT_FILES[args.kind],
+                   executions,
+                   args.total_iter,
+                   args.iter_show,
+                   workers = args.workers,
+                   exp_start = args.exp_start,
+                   exp_end = args.exp_end,
+                   seed = args.seed,
+                   log_file = log_file)
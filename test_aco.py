@@ -3,8 +3,8 @@ import os
 
 from networkx.classes import graph
 from model.graph_env import PPGraph
-from model.aco import ACOPP
-import random_walk.rw_models as rw
+from runner import build_graph, build_optimizer
+from utils.results import ResultsStore
 import numpy as np
 import pandas as pd
 import argparse
@@ -38,15 +38,15 @@ ITER_SHOW = 25
 EXECUTIONS_PER_EXPERIMENT = 30
 
 # Init to a particular seed
-np.random.seed(SEED)
+rng = np.random.default_rng(SEED)
 
 # Opening xlsx file with the parameters specifications
 params = pd.read_excel(EXPERIMENT_FILE, sheet_name=args.exp_name)
 
-# Create a dir where I save the results
+# Create the store where I save the results, the runs are written in
+# chunks and the buffered ones are written when the experiment stops
 saving_dir = "stuff/results/aco_pp/histories_{}/".format(args.exp_name)     
-if not os.path.exists(saving_dir):         
-    os.makedirs(saving_dir)
+store = ResultsStore(saving_dir)
     
 # 
 logging.info("Running experiment: {}".format(args.exp_name))
@@ -55,47 +55,35 @@ logging.info("\n {}".format(params.head()))
 if args.exp_start is not None and args.exp_end is not None:
     params = params.loc[(params.index >= args.exp_start) & (params.index < args.exp_end)]
 
-for index, row in params.iterrows():
-    for execution in range(EXECUTIONS_PER_EXPERIMENT):
-        exp_info = "\n ------------------------------- \n"
-        exp_info += f"| Running sub experiment: {index} execution: {execution} \n"
-        exp_info += f'| size: {row["size"]} \n'
-        exp_info += f'| ants: {row["ants"]} \n'
-        exp_info += f'| tau_0: {row["tau_0"]} \n'
-        exp_info += f'| alpha: {row["alpha"]} \n'
-        exp_info += f'| beta: {row["beta"]} \n'
-        exp_info += f'| p: {row["p"]} \n'
-        exp_info += f'| intensity: {row["intensity"]} \n'
-        exp_info += f'| local_p: {row["local_p"]} \n'
-        exp_info += f'| q_0: {row["q_0"]} \n'
-        exp_info += f'| penalty: {row["penalty"]} \n'
-        exp_info += f'| proximity: {row["proximity"]} \n'
-        exp_info += "-------------------------------"
-        logging.info(exp_info)
+with store:
+    for index, row in params.iterrows():
+        for execution in range(EXECUTIONS_PER_EXPERIMENT):
+            exp_info = "\n ------------------------------- \n"
+            exp_info += f"| Running sub experiment: {index} execution: {execution} \n"
+            exp_info += f'| size: {row["size"]} \n'
+            exp_info += f'| ants: {row["ants"]} \n'
+            exp_info += f'| tau_0: {row["tau_0"]} \n'
+            exp_info += f'| alpha: {row["alpha"]} \n'
+            exp_info += f'| beta: {row["beta"]} \n'
+            exp_info += f'| p: {row["p"]} \n'
+            exp_info += f'| intensity: {row["intensity"]} \n'
+            exp_info += f'| local_p: {row["local_p"]} \n'
+            exp_info += f'| q_0: {row["q_0"]} \n'
+            exp_info += f'| penalty: {row["penalty"]} \n'
+            exp_info += f'| proximity: {row["proximity"]} \n'
+            exp_info += "-------------------------------"
+            logging.info(exp_info)
         
-        # Create the graph
-        graph = PPGraph(size = row['size'], tau_0 = row['tau_0'])
+            # Create the graph
+            graph = build_graph(row, row['tau_0'], rng)
 
-        # Create the optimizer using the current graph
-        optimizer = ACOPP(graph, 
-                            row["ants"], 
-                            row["alpha"], 
-                            row["beta"], 
-                            row["p"], 
-                            row["penalty"], 
-                            row["local_p"] if not np.isnan(row['local_p']) else None, 
-                            row["intensity"] if not np.isnan(row['intensity']) else None, 
-                            row["q_0"],
-                            row['proximity'] )
+            # Create the optimizer using the current graph
+            optimizer = build_optimizer(row, graph, rng)
 
-        # Execute the optimizer
-        history = optimizer.fit(TOTAL_ITER,iter_show = ITER_SHOW)
+            # Execute the optimizer
+            history = optimizer.fit(TOTAL_ITER,iter_show = ITER_SHOW)
 
-        file_name = "history_exp_{}_exc_{}_iter_{}.npy".format(
-            str(index).zfill(2),
-            str(execution).zfill(2),
-            TOTAL_ITER)
+            store.append(index, execution, dict(row, total_iter=TOTAL_ITER), history)
 
-        file_dir = os.path.join(saving_dir,file_name)
-
-        np.save(file_dir, history)
\ No newline at end of file
+# the small chunks of the time based flushes are merged
+store.compact()
@@ -5,8 +5,10 @@ from networkx.classes import graph
 from model.graph_env import PPGraph
 from model.aco import ACOPP
 from random_walk.rw_models import ProximityWalker
+from random_walk.bootstrap import bootstrap_pheromones
 import random_walk.rw_models as rw
 import numpy as np
+from utils.results import ResultsStore
 
 # directories
 EXPERIMENT_NAME = "evaporation_rate"
@@ -14,9 +16,6 @@ SAVING_DIR = "stuff/results/aco_pp/histories_{}/".format(EXPERIMENT_NAME)
 SIZE = 20
 N_RANDOM_WALKS = 100
 
-if not os.path.exists(SAVING_DIR):
-    os.makedirs(SAVING_DIR)
-
 # Define the parameters of our model
 ants = 10
 tau_0 = 1
@@ -38,7 +37,7 @@ graph = PPGraph(size = SIZE, tau_0 = tau_0)
 
 # Execute random walk bootstrapping
 walker = ProximityWalker(graph, q_0=0.5)
-graph = walker.walk(N_RANDOM_WALKS)
+graph = bootstrap_pheromones(graph, walker, N_RANDOM_WALKS)
 
 # Create the optimizer using the current graph
 optimizer = ACOPP(graph, ants, alpha, beta, p, penalty, local_p, intensity, q_0)
@@ -46,16 +45,23 @@ optimizer = ACOPP(graph, ants, alpha, beta, p, penalty, local_p, intensity, q_0)
 # Execute the optimizer
 history = optimizer.fit(total_iter,iter_show = iter_show)
 
-file_name = "history_{}_{}_{}_{}_{}_{}_{}.npy".format(
-    ants,
-    alpha,
-    beta,
-    p,
-    q_0,
-    penalty,
-    total_iter)
+params = {
+    "size": SIZE,
+    "n_rw": N_RANDOM_WALKS,
+    "ants": ants,
+    "tau_0": tau_0,
+    "alpha": alpha,
+    "beta": beta,
+    "p": p,
+    "intensity": intensity,
+    "local_p": local_p,
+    "q_0": q_0,
+    "penalty": penalty,
+    "total_iter": total_iter
+}
 
-file_dir = os.path.join(SAVING_DIR,file_name)
+# every run is a new execution of the same parameters
+with ResultsStore(SAVING_DIR) as store:
+    store.append(0, len(store.stored), params, history)
 
-np.save(file_dir, history)
 
@@ -3,7 +3,8 @@ import os
 
 from networkx.classes import graph
 import model.graph_env as ge
-import random_walk.rw_models as rw
+from runner import build_graph, build_walker
+from utils.results import ResultsStore
 import numpy as np
 import pandas as pd
 
@@ -37,15 +38,15 @@ TOTAL_ITER = 100
 ITER_SHOW = 25
 
 # Init to a particular seed
-np.random.seed(SEED)
+rng = np.random.default_rng(SEED)
 
 # Opening xlsx file with the parameters specifications
 params = pd.read_excel(EXPERIMENT_FILE, sheet_name=args.exp_name)
 
-# Create a dir where I save the results
+# Create the store where I save the results, the runs are written in
+# chunks and the buffered ones are written when the experiment stops
 saving_dir = "stuff/results/aco_pp/histories_{}/".format(args.exp_name)     
-if not os.path.exists(saving_dir):         
-    os.makedirs(saving_dir)
+store = ResultsStore(saving_dir)
 
 
 logging.info("Running experiment: {}".format(args.exp_name))
@@ -54,56 +55,36 @@ logging.info("\n {}".format(params.head()))
 if args.exp_start is not None and args.exp_end is not None:
     params = params.loc[(params.index >= args.exp_start) & (params.index < args.exp_end)]
 
-for index, row in params.iterrows():
-    exp_info = "\n ------------------------------- \n"
-    exp_info += f"| Running sub experiment: {index} \n"
-    exp_info += f'| type: {row["type"]} \n'
-    exp_info += f'| n_rw: {row["n_rw"]} \n'
-    exp_info += f'| size: {row["size"]} \n'
-    exp_info += f'| q_0: {row["q_0"]} \n'
-    exp_info += "-------------------------------"
-    logging.info(exp_info)
-
-    # Create the graph
-    graph = ge.PPGraph(size=row["size"], tau_0=0.1)
-
-    # Create the walker
-    if row["type"] == "greedy":
-        walker = rw.GreedyWalker(graph, 
-                            q_0 = row["q_0"], 
-                            advantage = row["advantage"])
-    elif row["type"] == "levy_greedy":
-        walker = rw.LevyFlightGreedyWalker(graph, 
-                                            q_0 = row["q_0"],
-                                            omega = row["omega"],
-                                            advantage = row["advantage"])
-    elif row["type"] == "proximity":
-        walker = rw.ProximityWalker(graph, 
-                                q_0 = row["q_0"], 
-                                proximity_mode = row["proximity"])
-
-    elif row["type"] == "levy_proximity":
-        walker = rw.LevyFlightProximityWalker(graph, 
-                                q_0 = row["q_0"], 
-                                omega = row["omega"],
-                                proximity_mode = row["proximity"])
-    else:
-        logging.exception(f'The type {row["type"]} is not defined')
-
-    # Perform the walk
-    distances_list = walker.walk(row['n_rw'])
-
-
-    file_name = "history_exp_{}.npy".format(
-        str(index).zfill(2))
-    file_dir = os.path.join(saving_dir,file_name)
-
-    history = {
-        "distances" : np.array(distances_list),
-        "mean"  : np.mean(distances_list),
-        "std"  : np.std(distances_list),
-        "sem"  : np.std(distances_list, ddof=1) / np.sqrt(np.size(distances_list))
-    }
-
-
-    np.save(file_dir, history)
\ No newline at end of file
+with store:
+    for index, row in params.iterrows():
+        exp_info = "\n ------------------------------- \n"
+        exp_info += f"| Running sub experiment: {index} \n"
+        exp_info += f'| type: {row["type"]} \n'
+        exp_info += f'| n_rw: {row["n_rw"]} \n'
+        exp_info += f'| size: {row["size"]} \n'
+        exp_info += f'| q_0: {row["q_0"]} \n'
+        exp_info += "-------------------------------"
+        logging.info(exp_info)
+
+        # Create the graph
+        graph = build_graph(row, 0.1, rng)
+
+        # Create the walker
+        walker = build_walker(row, graph, rng)
+
+        # Perform the walk
+        distances_list = walker.walk(row['n_rw'])
+
+
+        history = {
+            "distances" : np.array(distances_list),
+            "mean"  : np.mean(distances_list),
+            "std"  : np.std(distances_list),
+            "sem"  : np.std(distances_list, ddof=1) / np.sqrt(np.size(distances_list))
+        }
+
+
+        store.append(index, 0, row, history)
+
+# the small chunks of the time based flushes are merged
+store.compact()
@@ -0,0 +1,63 @@
+import os
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.png', '.bmp', '.gif', '.pgm', '.pbm', '.tif', '.tiff', '.jpg', '.jpeg')
+
+def load_occupancy(filename, size, mmap = False):
+  """
+  Load a map of walls as a flat boolean occupancy array of size * size
+  nodes, True for the walls. The format is given by the file:
+    .npy with integers (1D):  ids of the wall nodes (the legacy format)
+    .npy with booleans (1D):  occupancy of each node
+    .npy with a (size, size) grid: nonzero cells are walls
+    .npz with 'bits' and 'shape': bit-packed grid written by save_occupancy
+    images: grayscale of each pixel, the dark pixels (< 128) are walls
+  :param filename: file of the map
+  :param size:     size of the lattice
+  :param mmap:     memory-map the .npy grids instead of reading them, the
+                   returned array is then a read only view of the file
+  :return: (size * size,) boolean array
+  """
+  n_nodes = size * size
+  extension = os.path.splitext(filename)[1].lower()
+
+  if extension == '.npz':
+    with np.load(filename) as packed:
+      shape = tuple(packed['shape'])
+      occupancy = np.unpackbits(packed['bits'], count=int(np.prod(shape))).view(bool)
+    occupancy = occupancy.reshape(shape)
+  elif extension in IMAGE_EXTENSIONS:
+    with Image.open(filename) as image:
+      occupancy = np.asarray(image.convert('L')) < 128
+  else:
+    occupancy = np.load(filename, mmap_mode='r' if mmap else None)
+    if occupancy.ndim == 1 and occupancy.dtype != bool:
+      walls = np.zeros(n_nodes, dtype=bool)
+      walls[occupancy] = True
+      return walls
+
+  if occupancy.size != n_nodes or occupancy.ndim not in (1, 2) or \
+     (occupancy.ndim == 2 and occupancy.shape != (size, size)):
+    raise ValueError("The map {} with shape {} does not fit a lattice of size {}"
+                     .format(filename, occupancy.shape, size))
+
+  occupancy = occupancy.reshape(n_nodes)
+  return occupancy if occupancy.dtype == bool else occupancy != 0
+
+
+def save_occupancy(filename, walls, size):
+  """
+  Save the occupancy array walls of a lattice of size x size nodes in the
+  format given by the extension of filename: a bit-packed .npz (1 bit per
+  node), a boolean .npy grid or an image with the walls in black.
+  """
+  grid = np.asarray(walls, dtype=bool).reshape((size, size))
+  extension = os.path.splitext(filename)[1].lower()
+
+  if extension == '.npz':
+    np.savez_compressed(filename, bits=np.packbits(grid), shape=np.array(grid.shape))
+  elif extension in IMAGE_EXTENSIONS:
+    Image.fromarray(np.where(grid, 0, 255).astype(np.uint8)).save(filename)
+  else:
+    np.save(filename, grid)
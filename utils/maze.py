@@ -0,0 +1,235 @@
+import numpy as np
+from model.kernels import NUMBA_AVAILABLE
+from utils.sampling import get_rng
+
+# without numba the kernels of the mazes are plain python functions,
+# slower but with the same results
+if NUMBA_AVAILABLE:
+  from numba import njit
+
+METHODS = ('backtracker', 'prim', 'density', 'cellular')
+# fraction of walls of the random fields
+DEFAULT_DENSITY = {'density': 0.3, 'cellular': 0.45}
+
+# offsets (row, col) to the neighbor nodes, up, down, left and right, and
+# to the neighbor cells of the mazes, two nodes away
+NODE_STEPS = np.array([[-1, 0], [1, 0], [0, -1], [0, 1]], dtype=np.int64)
+CELL_STEPS = 2 * NODE_STEPS
+
+
+def carve_backtracker(grid, start_row, start_col, uniforms):
+  """
+  Recursive backtracker (randomized depth first search) over the cells of
+  grid, the nodes with even row and col. From the current cell the walk
+  carves the passage to a random unvisited neighbor cell, and it goes
+  back through the stack when there is none. The stack is an array, so
+  the mazes are not limited by the recursion depth.
+  :param grid:     (size, size) boolean array full of walls, carved in place
+  :param uniforms: uniform numbers in [0, 1), one per cell
+  """
+  size = grid.shape[0]
+  stack = np.empty((((size + 1) // 2) ** 2, 2), dtype=np.int64)
+  options = np.empty(4, dtype=np.int64)
+
+  grid[start_row, start_col] = False
+  stack[0, 0] = start_row
+  stack[0, 1] = start_col
+  top = 1
+  draw = 0
+  while top > 0:
+    row = stack[top - 1, 0]
+    col = stack[top - 1, 1]
+
+    n_options = 0
+    for k in range(4):
+      next_row = row + CELL_STEPS[k, 0]
+      next_col = col + CELL_STEPS[k, 1]
+      if 0 <= next_row < size and 0 <= next_col < size and grid[next_row, next_col]:
+        options[n_options] = k
+        n_options += 1
+
+    if n_options == 0:
+      top -= 1
+      continue
+
+    k = options[int(uniforms[draw] * n_options)]
+    draw += 1
+    next_row = row + CELL_STEPS[k, 0]
+    next_col = col + CELL_STEPS[k, 1]
+    grid[row + NODE_STEPS[k, 0], col + NODE_STEPS[k, 1]] = False
+    grid[next_row, next_col] = False
+    stack[top, 0] = next_row
+    stack[top, 1] = next_col
+    top += 1
+
+
+def carve_prim(grid, start_row, start_col, uniforms):
+  """
+  Randomized Prim's algorithm over the cells of grid, the nodes with even
+  row and col. The frontier keeps the passages from the cells of the maze
+  to their neighbor cells; a random one is taken each time and carved if
+  its cell is not in the maze yet.
+  :param grid:     (size, size) boolean array full of walls, carved in place
+  :param uniforms: uniform numbers in [0, 1), four per cell
+  """
+  size = grid.shape[0]
+  # each cell adds at most four passages to the frontier
+  frontier = np.empty((4 * ((size + 1) // 2) ** 2, 3), dtype=np.int64)
+  n_frontier = 0
+  draw = 0
+
+  grid[start_row, start_col] = False
+  row = start_row
+  col = start_col
+  while True:
+    for k in range(4):
+      next_row = row + CELL_STEPS[k, 0]
+      next_col = col + CELL_STEPS[k, 1]
+      if 0 <= next_row < size and 0 <= next_col < size and grid[next_row, next_col]:
+        frontier[n_frontier, 0] = row
+        frontier[n_frontier, 1] = col
+        frontier[n_frontier, 2] = k
+        n_frontier += 1
+
+    # the passage is taken out by swapping it with the last one
+    carved = False
+    while n_frontier > 0 and not carved:
+      i = int(uniforms[draw] * n_frontier)
+      draw += 1
+      row = frontier[i, 0]
+      col = frontier[i, 1]
+      k = frontier[i, 2]
+      frontier[i] = frontier[n_frontier - 1]
+      n_frontier -= 1
+
+      next_row = row + CELL_STEPS[k, 0]
+      next_col = col + CELL_STEPS[k, 1]
+      if grid[next_row, next_col]:
+        grid[row + NODE_STEPS[k, 0], col + NODE_STEPS[k, 1]] = False
+        grid[next_row, next_col] = False
+        row = next_row
+        col = next_col
+        carved = True
+
+    if not carved:
+      return
+
+
+def flood_fill(grid, start_row, start_col):
+  """return the (size, size) boolean array of the free nodes of grid that
+  are reachable from (start_row, start_col) with breadth first search
+  """
+  size = grid.shape[0]
+  reached = np.zeros(grid.shape, dtype=np.bool_)
+  queue = np.empty(size * size, dtype=np.int64)
+
+  reached[start_row, start_col] = True
+  queue[0] = start_row * size + start_col
+  head = 0
+  tail = 1
+  while head < tail:
+    row, col = divmod(queue[head], size)
+    head += 1
+    for k in range(4):
+      next_row = row + NODE_STEPS[k, 0]
+      next_col = col + NODE_STEPS[k, 1]
+      if 0 <= next_row < size and 0 <= next_col < size \
+         and not grid[next_row, next_col] and not reached[next_row, next_col]:
+        reached[next_row, next_col] = True
+        queue[tail] = next_row * size + next_col
+        tail += 1
+  return reached
+
+
+if NUMBA_AVAILABLE:
+  carve_backtracker = njit(cache=True)(carve_backtracker)
+  carve_prim = njit(cache=True)(carve_prim)
+  flood_fill = njit(cache=True)(flood_fill)
+
+
+def get_cellular_automaton(grid, steps):
+  """
+  Smooth a random field into caves: in each step a node becomes a wall
+  if at least 5 of the 9 nodes of its 3 x 3 neighborhood are walls. The
+  nodes out of the lattice count as walls.
+  """
+  size = grid.shape[0]
+  for _ in range(steps):
+    padded = np.pad(grid, 1, constant_values=True).astype(np.int8)
+    walls = sum(padded[i:i + size, j:j + size] for i in range(3) for j in range(3))
+    grid = walls >= 5
+  return grid
+
+
+def connect(grid, start_node, target_node, rng):
+  """
+  Guarantee a path between start_node and target_node. Both nodes are
+  freed, and if target_node is not reachable from start_node a random
+  monotone corridor is carved from target_node towards start_node until
+  it meets the free nodes reachable from start_node.
+  """
+  size = grid.shape[0]
+  start_row, start_col = divmod(start_node, size)
+  row, col = divmod(target_node, size)
+  grid[start_row, start_col] = False
+  grid[row, col] = False
+
+  reached = flood_fill(grid, start_row, start_col)
+  while not reached[row, col]:
+    grid[row, col] = False
+    moves = []
+    if row != start_row:
+      moves.append((np.sign(start_row - row), 0))
+    if col != start_col:
+      moves.append((0, np.sign(start_col - col)))
+    d_row, d_col = moves[rng.integers(len(moves))]
+    row, col = row + d_row, col + d_col
+  return grid
+
+
+def generate_maze(size, method = 'backtracker', start_node = 0, target_node = None,
+                  density = None, steps = 4, rng = None):
+  """
+  Generate a random map of walls for a lattice of size x size nodes.
+    'backtracker': perfect maze of the recursive backtracker, long
+                   corridors with few branches
+    'prim':        perfect maze of the randomized Prim's algorithm, short
+                   corridors with many branches
+    'density':     each node is a wall with probability density
+    'cellular':    caves of a cellular automaton over a random field
+  The mazes carve their passages between the nodes with even row and col.
+  In every map start_node and target_node are free and connected.
+  :param size:        size of the lattice
+  :param method:      algorithm of the map
+  :param start_node:  start node of the path planning
+  :param target_node: target node, the last node by default
+  :param density:     fraction of walls of 'density' and 'cellular'
+  :param steps:       steps of the cellular automaton
+  :param rng:         numpy.random.Generator or seed of the map
+  :return: (size * size,) boolean occupancy array, True for the walls
+  """
+  if method not in METHODS:
+    raise ValueError("Unknown method: {}".format(method))
+  rng = get_rng(rng)
+  target_node = size * size - 1 if target_node is None else target_node
+
+  if method in ('backtracker', 'prim'):
+    grid = np.ones((size, size), dtype=bool)
+    # the maze grows from the cell of start_node
+    start_row, start_col = divmod(start_node, size)
+    # the random numbers of the kernels come from rng, one per cell for
+    # the backtracker and one per passage of the frontier for Prim's
+    n_cells = ((size + 1) // 2) ** 2
+    if method == 'backtracker':
+      carve, n_uniforms = carve_backtracker, n_cells
+    else:
+      carve, n_uniforms = carve_prim, 4 * n_cells
+    carve(grid, start_row - start_row % 2, start_col - start_col % 2,
+          rng.random(n_uniforms))
+  else:
+    density = DEFAULT_DENSITY[method] if density is None else density
+    grid = rng.random((size, size)) < density
+    if method == 'cellular':
+      grid = get_cellular_automaton(grid, steps)
+
+  return connect(grid, start_node, target_node, rng).ravel()
@@ -1,5 +1,4 @@
 import numpy as np
-from model.graph_env import State
 
 def get_distance(pos1, pos2, distance):
   x1, y1 = pos1
@@ -23,9 +22,9 @@ def get_proximity(graph, current_node, neighbor_node, target_node,
   :param mode:          perform the proximity 1 or proximity 2
   :param distance:      used distance to calculate the proximity
   """
-  pos_neighbor = graph.nodes[neighbor_node]['pos']
-  pos_target = graph.nodes[target_node]['pos']
-  pos_current = graph.nodes[current_node]['pos']
+  pos_neighbor = graph.pos[neighbor_node]
+  pos_target = graph.pos[target_node]
+  pos_current = graph.pos[current_node]
 
   # distance: current node to target
   dis_curr2target = get_distance(pos_current, pos_target, distance)
@@ -66,4 +65,90 @@ def normalize_array(array, mode):
       array = (array - min) / (max - min)
 
 
-  return array
\ No newline at end of file
+  return array
+
+
+def normalize_rows(array, mask, mode):
+  """
+  Row by row version of normalize_array, only the entries where mask is
+  True take part in the normalization of each row.
+  :param array: array (n, k) to normalize
+  :param mask:  boolean array (n, k) with the valid entries
+  :param mode:  'standard', 'l2-norm' or 'max-min'
+  """
+  array = np.where(mask, array, 0.)
+  count = mask.sum(axis=1, keepdims=True)
+
+  if mode == 'standard':
+    mean = array.sum(axis=1, keepdims=True) / count
+    std = np.sqrt((np.where(mask, array - mean, 0.) ** 2).sum(axis=1, keepdims=True) / count)
+    array = np.where(std != 0.0, (array - mean) / np.where(std != 0.0, std, 1.), array)
+
+  elif mode == 'l2-norm':
+    array = array / np.linalg.norm(array, axis=1, keepdims=True)
+
+  elif mode == 'max-min':
+    max = np.where(mask, array, -np.inf).max(axis=1, keepdims=True)
+    min = np.where(mask, array, np.inf).min(axis=1, keepdims=True)
+    array = np.where(max - min != 0.0, (array - min) / np.where(max - min != 0.0, max - min, 1.), array)
+
+  return np.where(mask, array, 0.)
+
+
+def get_proximities(graph, current_nodes, neighbor_nodes, target_node,
+                    mode = 'proximity_1', distance = 'euclidean'):
+  """
+  Proximities. Vectorized version of get_proximity, calculate the proximity
+  of arrays of neighbor nodes at once.
+  :param graph:          graph environment
+  :param current_nodes:  array of indices of the current nodes i
+  :param neighbor_nodes: array of indices of the neighbor nodes j, it has to
+                         broadcast with current_nodes
+  :param target_node:    index of the target node t
+  :param mode:           perform the proximity 1 or proximity 2
+  :param distance:       used distance to calculate the proximity
+  """
+  current_nodes = np.asarray(current_nodes)
+  neighbor_nodes = np.asarray(neighbor_nodes)
+
+  # positions with the coordinates in the first axis, so get_distance
+  # can unpack them
+  pos_target = graph.pos[target_node].astype(float)
+  pos_current = np.moveaxis(graph.pos[current_nodes], -1, 0).astype(float)
+  pos_neighbor = np.moveaxis(graph.pos[neighbor_nodes], -1, 0).astype(float)
+
+  is_target = neighbor_nodes == target_node
+
+  # distance: neighbor to target, the target itself is masked below
+  dis_neig2target = get_distance(pos_neighbor, pos_target, distance)
+  dis_neig2target = np.where(is_target, 1., dis_neig2target)
+
+  if mode == 'proximity_1':
+    proximity = 1 / dis_neig2target
+  elif mode == 'proximity_2':
+    # distance: current node to target
+    dis_curr2target = get_distance(pos_current, pos_target, distance)
+    proximity = dis_curr2target / dis_neig2target
+
+  return np.where(is_target, 1., proximity)
+
+
+def get_proximity_table(graph, target_node, mode = 'proximity_1', distance = 'euclidean'):
+  """
+  Proximity table. Calculate the proximity of every neighbor slot of the
+  graph, the value of the slot k of the node i is the proximity of
+  graph.neighbors[i, k] and the empty slots are 0.
+  :param graph:       graph environment
+  :param target_node: index of the target node t
+  :param mode:        perform the proximity 1 or proximity 2
+  :param distance:    used distance to calculate the proximity
+  """
+  nodes = np.arange(graph.number_of_nodes())
+  exists = graph.neighbors >= 0
+
+  # the empty slots are evaluated on the target and masked later
+  neighbors = np.where(exists, graph.neighbors, target_node)
+  proximities = get_proximities(graph, nodes[:, None], neighbors,
+                                target_node, mode, distance)
+
+  return np.where(exists, proximities, 0.)
@@ -0,0 +1,160 @@
+import numpy as np
+from model.kernels import shortest_path
+
+class PathBuffer():
+  def __init__(self, n_nodes, capacity = 256):
+    """
+    Path of an agent over a graph. The sequence of nodes is kept in a
+    preallocated array that doubles its size when it is full, and the
+    visits are marked with a stamp per node, so checking if a node was
+    visited is O(1) and the buffers are reused between walks.
+    :param n_nodes:  number of nodes of the graph
+    :param capacity: initial number of nodes that the path can hold
+    """
+    self.buffer = np.empty(capacity, dtype=np.int64)
+    self.length = 0
+    self.stamps = np.zeros(n_nodes, dtype=np.int64)
+    self.stamp = 0
+
+  def reset(self, start_node):
+    """start a new path from start_node, the visits of the last path
+    are forgotten by moving to a new stamp
+    """
+    self.stamp += 1
+    self.length = 0
+    self.append(start_node)
+
+  def append(self, node):
+    if self.length == self.buffer.size:
+      self.buffer = np.concatenate([self.buffer, np.empty_like(self.buffer)])
+    self.buffer[self.length] = node
+    self.length += 1
+    self.stamps[node] = self.stamp
+
+  def is_visited(self, node):
+    return self.stamps[node] == self.stamp
+
+  def visited_mask(self, nodes):
+    """return if each node of the array nodes has already been visited
+    """
+    return self.stamps[nodes] == self.stamp
+
+  @property
+  def nodes(self):
+    """view of the sequence of nodes of the path"""
+    return self.buffer[:self.length]
+
+  def edges(self):
+    """return the path as a list of (node1, node2) tuples"""
+    nodes = self.nodes
+    return list(zip(nodes[:-1], nodes[1:]))
+
+  def __len__(self):
+    # number of steps of the path
+    return max(self.length - 1, 0)
+
+
+def get_path_edges(graph, nodes, jumps = False):
+  """
+  Return the ids of the edges of the path given by the sequence nodes.
+  :param graph: graph environment
+  :param nodes: array with the sequence of nodes of the path
+  :param jumps: if True, the steps between nodes that are not neighbors
+                (e.g. long range jumps) are skipped
+  """
+  nodes = np.asarray(nodes)
+  slots = graph.neighbors[nodes[:-1]] == nodes[1:, None]
+  edges = graph.edge_index[nodes[:-1], np.argmax(slots, axis=1)]
+  if jumps:
+    edges = edges[slots.any(axis=1)]
+  return edges
+
+
+class VisitStamps():
+  def __init__(self, n_agents, n_nodes):
+    """
+    Visited nodes of a group of agents that move at the same time. Each
+    reset moves to a new stamp instead of clearing the (n_agents, n_nodes)
+    array, so the array is allocated once and reused.
+    :param n_agents: number of agents
+    :param n_nodes:  number of nodes of the graph
+    """
+    self.stamps = np.zeros((n_agents, n_nodes), dtype=np.int32)
+    self.stamp = 0
+
+  def reset(self, start_nodes):
+    self.stamp += 1
+    self.stamps[np.arange(len(self.stamps)), start_nodes] = self.stamp
+
+  def mark(self, agents, nodes):
+    self.stamps[agents, nodes] = self.stamp
+
+  def is_visited(self, agents, nodes):
+    return self.stamps[agents, nodes] == self.stamp
+
+
+def get_last_visits(nodes, n_nodes):
+  """return an array with the index of the last visit of each node in
+  the sequence nodes, -1 for the nodes that were not visited
+  """
+  nodes = np.asarray(nodes)
+  unique, reversed_index = np.unique(nodes[::-1], return_index=True)
+  last = np.full(n_nodes, -1, dtype=np.int64)
+  last[unique] = len(nodes) - 1 - reversed_index
+  return last
+
+
+def loop_erase(nodes, n_nodes):
+  """
+  Chronological loop erasure. Return the path from the first to the last
+  node of nodes without cycles: every time a node is reached the path
+  continues from its last visit.
+  :param nodes:   array with the sequence of nodes of the path
+  :param n_nodes: number of nodes of the graph
+  """
+  nodes = np.asarray(nodes)
+  last = get_last_visits(nodes, n_nodes)
+
+  i = last[nodes[0]]
+  erased = [nodes[i]]
+  while i < len(nodes) - 1:
+    i = last[nodes[i + 1]]
+    erased.append(nodes[i])
+  return np.array(erased, dtype=nodes.dtype)
+
+
+def shortcut_path(graph, nodes):
+  """
+  Loop erasure plus shortcuts along the lattice. From each node of the
+  loop erased path the path jumps to its furthest node that is a neighbor
+  of it, so the detours between neighbor nodes (e.g. U-turns) are
+  replaced by a single edge and the result is never longer than the loop
+  erasure. The path must be a sequence of neighbors.
+  :param graph: graph environment
+  :param nodes: array with the sequence of nodes of the path
+  """
+  n_nodes = graph.number_of_nodes()
+  nodes = loop_erase(nodes, n_nodes)
+  last = get_last_visits(nodes, n_nodes)
+
+  # furthest index of the path reachable with one edge from each index
+  neighbors = graph.neighbors[nodes]
+  reach = np.where(neighbors >= 0, last[neighbors], -1).max(axis=1)
+
+  i = last[nodes[0]]
+  shortcut = [nodes[i]]
+  while i < len(nodes) - 1:
+    i = reach[i]
+    shortcut.append(nodes[i])
+  return np.array(shortcut, dtype=nodes.dtype)
+
+
+def get_shortest_path(graph, start_node, target_node):
+  """
+  Exact shortest path between start_node and target_node over the free
+  nodes of graph, with the A* search of model.kernels.shortest_path.
+  :return: (path, cost), an empty path and inf if there is no path
+  """
+  min_distance = max(graph.distance.min(), 0.) if graph.number_of_edges() else 0.
+  return shortest_path(graph.neighbors, graph.edge_index, graph.distance, graph.pos,
+                       start_node, target_node, min_distance)
@@ -0,0 +1,135 @@
+import os
+import threading
+from collections import deque
+import numpy as np
+import matplotlib.pyplot as plt
+from PIL import Image
+
+class FrameRecorder():
+  def __init__(self, output_dir, capacity = 64, every = 1, animation = None,
+               fps = 10, scale = 8, cmaps = ('viridis', 'plasma'),
+               animation_width = 512):
+    """
+    Off-thread recorder of the pheromones and the exploration of a graph.
+    record only copies the pheromone and counter arrays into a ring buffer,
+    and a background thread renders each snapshot as an image of the grid
+    and writes it as a PNG. When the renderer falls behind, the oldest
+    snapshots of the buffer are dropped instead of blocking the caller.
+    :param output_dir: directory of the frames, it is created if needed
+    :param capacity:   snapshots that the ring buffer holds
+    :param every:      record one of every `every` iterations
+    :param animation:  name of an animated GIF with all the frames, written
+                       in output_dir from the PNG frames when the recorder
+                       is closed (optional)
+    :param fps:        frames per second of the animation
+    :param scale:      pixels per node of the frames
+    :param cmaps:      colormaps of the pheromones and the exploration
+    :param animation_width: maximum width in pixels of the frames of the
+                       animation, wider frames are downscaled
+    """
+    self.output_dir = output_dir
+    self.every = every
+    self.animation = animation
+    self.fps = fps
+    self.scale = scale
+    self.animation_width = animation_width
+    self.cmaps = [ plt.get_cmap(cmap) for cmap in cmaps ]
+    os.makedirs(output_dir, exist_ok=True)
+
+    self.frames = deque(maxlen=capacity)
+    self.condition = threading.Condition()
+    self.closed = False
+    self.dropped = 0
+    self.rendered = 0
+    self.files = []
+    self.error = None
+
+    self.thread = threading.Thread(target=self.render_loop, daemon=True)
+    self.thread.start()
+
+  def record(self, graph, iteration, counter = None):
+    """add a snapshot of the pheromones and counters of graph, or of the
+    visits per node counter instead of the counters of graph
+    """
+    if iteration % self.every:
+      return
+
+    counter = graph.counter if counter is None else counter
+    frame = (graph, iteration, graph.pheromone.copy(), np.array(counter, copy=True))
+    with self.condition:
+      if len(self.frames) == self.frames.maxlen:
+        self.dropped += 1
+      self.frames.append(frame)
+      self.condition.notify()
+
+  def render_loop(self):
+    while True:
+      with self.condition:
+        while not self.frames and not self.closed:
+          self.condition.wait()
+        if not self.frames:
+          return
+        graph, iteration, pheromone, counter = self.frames.popleft()
+
+      try:
+        self.render(graph, iteration, pheromone, counter)
+      except Exception as error:
+        self.error = error
+        return
+
+  def render(self, graph, iteration, pheromone, counter):
+    """
+    Render a frame as an image without a matplotlib figure: each matrix is
+    normalized, mapped to the colors of its colormap and scaled up, the
+    pheromones on the left and the exploration on the right.
+    """
+    panels = []
+    for matrix, cmap in [(graph.get_node_pheromones(pheromone), self.cmaps[0]),
+                         (counter, self.cmaps[1])]:
+      matrix = matrix.reshape((graph.size, graph.size)).astype(float)
+      low, high = matrix.min(), matrix.max()
+      normalized = (matrix - low) / (high - low) if high > low else np.zeros_like(matrix)
+      pixels = cmap(normalized, bytes=True)[..., :3]
+      panels.append(pixels.repeat(self.scale, axis=0).repeat(self.scale, axis=1))
+
+    gap = np.full((panels[0].shape[0], self.scale, 3), 255, dtype=np.uint8)
+    frame = Image.fromarray(np.concatenate([panels[0], gap, panels[1]], axis=1))
+    filename = os.path.join(self.output_dir, 'frame_{:05d}.png'.format(iteration))
+    frame.save(filename)
+    self.files.append(filename)
+    self.rendered += 1
+
+  def close(self):
+    """render the snapshots left in the buffer, stop the thread and write
+    the animation
+    """
+    with self.condition:
+      self.closed = True
+      self.condition.notify()
+    self.thread.join()
+
+    if self.error is not None:
+      raise self.error
+
+    if self.animation is not None and self.files:
+      # the frames are read back one by one, none is kept in memory
+      # while recording
+      frames = (self.load_animation_frame(filename) for filename in self.files)
+      next(frames).save(os.path.join(self.output_dir, self.animation),
+                        save_all=True, append_images=frames,
+                        duration=int(1000 / self.fps), loop=0)
+
+  def load_animation_frame(self, filename):
+    """return the PNG frame filename downscaled to the animation width"""
+    with Image.open(filename) as frame:
+      frame = frame.convert('RGB')
+    if frame.width > self.animation_width:
+      height = max(1, round(frame.height * self.animation_width / frame.width))
+      frame = frame.resize((self.animation_width, height), Image.NEAREST)
+    return frame
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
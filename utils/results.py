@@ -0,0 +1,235 @@
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+
+PARAMS_FILE = "params.csv"
+CHUNK_PREFIX = "chunk_"
+
+class ResultsStore():
+  def __init__(self, directory, chunk_size = 64, flush_interval = 60):
+    """
+    Columnar store of the results of an experiment. The runs are buffered
+    and written in chunks, when chunk_size runs are buffered or when
+    flush_interval seconds have passed since the last chunk, so a killed
+    sweep loses at most those runs. Each chunk is a directory with one
+    .npy file per column:
+      index, execution:         (R,) row of the experiment file and execution
+      <key>:                    (R,) history values that are scalars
+      <key>_values, <key>_offsets: history values that are sequences, all the
+                                sequences of the chunk concatenated and the
+                                (R + 1,) offsets of each run
+    The parameters of each row are kept once in params.csv.
+    :param directory:  directory of the store, it is created if needed
+    :param chunk_size: runs per chunk
+    :param flush_interval: seconds after which the buffered runs are
+                           written, checked when a run is appended
+    """
+    self.directory = directory
+    self.chunk_size = chunk_size
+    self.flush_interval = flush_interval
+    self.runs = []
+    self.last_flush = time.monotonic()
+    os.makedirs(directory, exist_ok=True)
+
+    # parameters of each row of the experiment, {index: params}
+    self.params = load_params(directory).to_dict("index")
+    self.stored = { (index, execution)
+                    for chunk in get_chunks(directory)
+                    for index, execution in zip(np.load(os.path.join(chunk, "index.npy")),
+                                                np.load(os.path.join(chunk, "execution.npy"))) }
+
+  def __contains__(self, run):
+    """return if the (index, execution) run is already stored or buffered"""
+    return run in self.stored
+
+  def append(self, index, execution, params, history):
+    """
+    Add a run to the store, it is written with the next chunk.
+    :param params:  parameters of the row index of the experiment
+    :param history: dict with the results of the run
+    """
+    self.params[index] = dict(params)
+    self.runs.append((index, execution, history))
+    self.stored.add((index, execution))
+    if len(self.runs) >= self.chunk_size or \
+       time.monotonic() - self.last_flush >= self.flush_interval:
+      self.flush()
+
+  def flush(self):
+    """write the buffered runs as a new chunk"""
+    self.last_flush = time.monotonic()
+    if not self.runs:
+      return
+
+    self.write_chunk(self.runs)
+    tmp_params = os.path.join(self.directory, PARAMS_FILE + ".tmp")
+    pd.DataFrame.from_dict(self.params, orient="index").to_csv(tmp_params, index_label="index")
+    os.replace(tmp_params, os.path.join(self.directory, PARAMS_FILE))
+
+    self.runs = []
+
+  def compact(self):
+    """
+    Merge the chunks with less than chunk_size runs, e.g. the ones of the
+    time based flushes, into full chunks. The buffered runs are flushed
+    first. The merged chunks are written before the small ones are
+    removed, so an interrupted compaction does not lose runs.
+    """
+    self.flush()
+    small = [ chunk for chunk in get_chunks(self.directory)
+              if len(np.load(os.path.join(chunk, "index.npy"))) < self.chunk_size ]
+    if len(small) < 2:
+      return
+
+    runs = [ run for chunk in small for run in read_chunk(chunk) ]
+    for start in range(0, len(runs), self.chunk_size):
+      self.write_chunk(runs[start:start + self.chunk_size])
+    for chunk in small:
+      shutil.rmtree(chunk)
+
+  def write_chunk(self, runs):
+    """write the (index, execution, history) runs as a new chunk"""
+    columns = {
+        "index": np.array([ index for index, _, _ in runs ]),
+        "execution": np.array([ execution for _, execution, _ in runs ])
+    }
+    keys = sorted({ key for _, _, history in runs for key in history })
+    for key in keys:
+      values = [ history.get(key) for _, _, history in runs ]
+      if all(value is None or np.ndim(value) == 0 for value in values):
+        columns[key] = np.array([ np.nan if value is None else value for value in values ])
+      else:
+        values = [ np.ravel([] if value is None else value) for value in values ]
+        columns[key + "_values"] = np.concatenate(values)
+        columns[key + "_offsets"] = np.cumsum([0] + [ len(value) for value in values ])
+
+    # the chunk is written in a temporal directory that is renamed at once,
+    # its number follows the last chunk since compact removes chunks
+    chunks = get_chunks(self.directory)
+    number = int(os.path.basename(chunks[-1])[len(CHUNK_PREFIX):]) + 1 if chunks else 0
+    chunk = os.path.join(self.directory, "{}{:05d}".format(CHUNK_PREFIX, number))
+    tmp_chunk = chunk + ".tmp"
+    shutil.rmtree(tmp_chunk, ignore_errors=True)
+    os.makedirs(tmp_chunk)
+    for name, column in columns.items():
+      np.save(os.path.join(tmp_chunk, name + ".npy"), column)
+    os.replace(tmp_chunk, chunk)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.flush()
+
+
+def get_chunks(directory):
+  """return the sorted chunk directories of a store"""
+  if not os.path.exists(directory):
+    return []
+  return sorted( os.path.join(directory, name) for name in os.listdir(directory)
+                 if name.startswith(CHUNK_PREFIX) and not name.endswith(".tmp") )
+
+
+def read_chunk(chunk):
+  """return the (index, execution, history) runs of a chunk"""
+  columns = { file[:-len(".npy")]: np.load(os.path.join(chunk, file))
+              for file in os.listdir(chunk) }
+  runs = []
+  for row, (index, execution) in enumerate(zip(columns["index"], columns["execution"])):
+    history = {}
+    for name, column in columns.items():
+      if name.endswith("_offsets"):
+        key = name[:-len("_offsets")]
+        history[key] = columns[key + "_values"][column[row]:column[row + 1]]
+      elif not name.endswith("_values") and name not in ("index", "execution"):
+        history[name] = column[row]
+    runs.append((index, execution, history))
+  return runs
+
+
+def load_params(directory):
+  params_file = os.path.join(directory, PARAMS_FILE)
+  if not os.path.exists(params_file):
+    return pd.DataFrame()
+  return pd.read_csv(params_file, index_col="index")
+
+
+def filter_params(params, filters):
+  """
+  return the rows of params that match all the filters, each filter is
+  parameter = value, a list of values or a function over the column
+  """
+  mask = np.ones(len(params), dtype=bool)
+  for name, condition in filters.items():
+    column = params[name]
+    if callable(condition):
+      mask &= np.asarray(condition(column), dtype=bool)
+    elif isinstance(condition, (list, tuple, set)):
+      mask &= column.isin(condition).to_numpy()
+    else:
+      mask &= (column == condition).to_numpy()
+  return params[mask]
+
+
+def load_results(directory, columns = None, mmap_mode = None, **filters):
+  """
+  Load the runs of a ResultsStore whose parameters match the filters, e.g.
+  load_results(directory, ['distances_best'], alpha=1.0, ants=[10, 20]).
+  Only the requested columns are read, and with mmap_mode='r' they are
+  memory-mapped instead of loaded.
+  :param columns: history keys to load, all of them by default
+  :return: (params, runs) the DataFrame with the selected rows and a dict
+           with the 'index' and 'execution' arrays of the runs and a column
+           per history key, an array for the scalar values and a list of
+           arrays for the sequences
+  """
+  params = filter_params(load_params(directory), filters)
+  selected = params.index.to_numpy()
+
+  runs = {"index": [], "execution": []}
+  # columns of each chunk with selected runs, (number of runs, {key: part})
+  parts = []
+  for chunk in get_chunks(directory):
+    index = np.load(os.path.join(chunk, "index.npy"))
+    rows = np.flatnonzero(np.isin(index, selected))
+    if rows.size == 0:
+      continue
+
+    runs["index"].append(index[rows])
+    runs["execution"].append(np.load(os.path.join(chunk, "execution.npy"))[rows])
+
+    names = { file[:-len(".npy")] for file in os.listdir(chunk) }
+    keys = { name.rsplit("_", 1)[0] if name.endswith(("_values", "_offsets")) else name
+             for name in names } - {"index", "execution"}
+    chunk_columns = {}
+    for key in keys if columns is None else set(columns) & keys:
+      if key in names:
+        column = np.load(os.path.join(chunk, key + ".npy"), mmap_mode=mmap_mode)
+        chunk_columns[key] = column[rows]
+      else:
+        values = np.load(os.path.join(chunk, key + "_values.npy"), mmap_mode=mmap_mode)
+        offsets = np.load(os.path.join(chunk, key + "_offsets.npy"))
+        chunk_columns[key] = [ values[offsets[row]:offsets[row + 1]] for row in rows ]
+    parts.append((rows.size, chunk_columns))
+
+  for key in ("index", "execution"):
+    runs[key] = np.concatenate(runs[key]) if runs[key] else np.empty(0)
+
+  # the runs of the chunks without a key are padded with NaN, or with
+  # empty arrays for the sequences, so every column follows runs["index"]
+  keys = sorted({ key for _, chunk_columns in parts for key in chunk_columns })
+  for key in keys:
+    sequences = any(isinstance(chunk_columns.get(key), list) for _, chunk_columns in parts)
+    column = []
+    for n_runs, chunk_columns in parts:
+      part = chunk_columns.get(key)
+      if part is None:
+        part = [ np.empty(0) for _ in range(n_runs) ] if sequences else np.full(n_runs, np.nan)
+      elif sequences and not isinstance(part, list):
+        part = [ np.atleast_1d(value) for value in part ]
+      column.append(part)
+    runs[key] = [ run for part in column for run in part ] if sequences else np.concatenate(column)
+
+  return params, runs
@@ -0,0 +1,49 @@
+import numpy as np
+
+class UniformStream():
+  def __init__(self, rng, block_size = 1024):
+    """
+    Uniform numbers in [0, 1) drawn from rng in blocks, so asking for a
+    single number does not pay the cost of a call to the generator.
+    :param rng:        numpy.random.Generator used to draw the blocks
+    :param block_size: amount of numbers drawn at once
+    """
+    self.rng = rng
+    self.block_size = block_size
+    self.block = np.empty(0)
+    self.index = 0
+
+  def next(self):
+    if self.index == self.block.size:
+      self.block = self.rng.random(self.block_size)
+      self.index = 0
+    self.index += 1
+    return self.block[self.index - 1]
+
+
+def get_rng(rng = None):
+  """return rng, a new numpy.random.Generator if it is None, or one
+  seeded with rng if it is a seed
+  """
+  if isinstance(rng, np.random.Generator):
+    return rng
+  return np.random.default_rng(rng)
+
+
+def roulette_wheel(weights, uniforms):
+  """
+  Wheel selection. Choose an index of the last axis of weights with a
+  probability proportional to its weight, using a single uniform number
+  per choice instead of np.random.choice.
+  :param weights:  array (..., k) of non negative weights, at least one
+                   positive weight per choice
+  :param uniforms: uniform numbers in [0, 1) with shape weights.shape[:-1]
+  """
+  weights = np.asarray(weights)
+  cumulative = np.cumsum(weights, axis=-1)
+  wheel = np.asarray(uniforms) * cumulative[..., -1]
+  choice = (cumulative <= wheel[..., None]).sum(axis=-1)
+
+  # against round off, the choice never goes beyond the last positive weight
+  last_option = weights.shape[-1] - 1 - np.argmax(weights[..., ::-1] > 0, axis=-1)
+  return np.minimum(choice, last_option)
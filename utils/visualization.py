@@ -1,7 +1,6 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import os
-from utils.measures import get_pheromones_per_node
 
 PLOT_DIRS = 'stuff/results/plots/histograms'
 
@@ -52,13 +51,13 @@ def plot_histograms(dict_arrays = None, bins = 10, title="", filename = None, sa
 def draw_progress(base_class, iter, ant, step, draw_additional = False):
   # Create a canvas to display the visited cells, the ant, and the target
   # values: to traget, free cells, and obstacles
-  canvas = [ base_class.graph.nodes[i]['state'].value for i in sorted(base_class.graph.nodes()) ]
+  canvas = base_class.graph.get_state_array()
   # values: to the visited cells
-  for node in base_class.visited_nodes: canvas[node] = 0.2
+  canvas[base_class.visited_nodes] = 0.2
   # values: to the ant
   canvas[base_class.current_position] = 0.3
 
-  canvas = np.array(canvas).reshape((base_class.size, base_class.size))
+  canvas = canvas.reshape((base_class.size, base_class.size))
 
   def draw_grid_inner(ax):
       ax.set_title('Iteration {} - Ant {} - Step {}'.format(iter,ant,step))
@@ -69,7 +68,7 @@ def draw_progress(base_class, iter, ant, step, draw_additional = False):
       ax.invert_yaxis() #invert the y-axis so the first row of data is at the top
   
   def pheromones_plot(fig, ax):
-      pheromones = get_pheromones_per_node(base_class.graph)
+      pheromones = base_class.graph.get_pheromones_matrix()
       im = ax.pcolor(pheromones, edgecolors='k', cmap='viridis', linewidths=0.2)
       ax.set_title('Pheromones Distribution')
       ax.set_aspect('equal') #set the x and y axes to the same scale
@@ -80,8 +79,7 @@ def draw_progress(base_class, iter, ant, step, draw_additional = False):
       cbar=fig.colorbar(im, label='pheromones amount', ax = ax)
     
   def exploration_plot(fig, ax):
-      exploration = [ base_class.graph.nodes[i]['counter'] for i in sorted(base_class.graph.nodes()) ]
-      exploration = np.array(exploration).reshape((base_class.size, base_class.size))
+      exploration = base_class.graph.get_exploration_matrix()
       im2 = ax.pcolor(exploration, edgecolors='k', cmap='plasma', linewidths=0.2)
       ax.set_title('Exploration')
       ax.set_aspect('equal') #set the x and y axes to the same scale